@@ -6,15 +6,19 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ComfyDeploy")
 
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+ag_path = os.path.join(os.path.dirname(__file__))
+
+# The nodes directory is added before custom routes are imported, so both share the same helper modules
+if os.path.join(ag_path, "nodes") not in sys.path:
+    sys.path.append(os.path.join(ag_path, "nodes"))
+
 try:
     from . import custom_routes
     logger.info("[ComfyDeploy] custom routes successfully initialized")
 except Exception as e:
     logger.error(f"[ComfyDeploy] custom routes initialization failed: {str(e)}")
 
-sys.path.append(os.path.join(os.path.dirname(__file__)))
-ag_path = os.path.join(os.path.dirname(__file__))
-
 
 def get_python_files(_path):
     return [f[:-3] for f in os.listdir(_path) if f.endswith(".py")]
@@ -0,0 +1,103 @@
+"""
+Benchmark of serial vs thread-pool decoding of an image batch.
+
+Decodes every image of a local corpus with the External Image Batch decode path
+(exif_transpose, convert and tensor conversion), once serially and once per
+worker count, and reports the wall time and the speedup over serial decoding.
+Without --corpus a set of random JPEG and PNG images is generated in memory.
+
+Usage:
+    python benchmarks/bench_batch_decode.py [--corpus DIR] [--count 32] [--workers 2 4 8] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nodes"))
+import comfydeploy_utils  # noqa: E402
+from comfydeploy_utils import load_image_tensor  # noqa: E402
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def load_corpus(corpus, count):
+    contents = []
+    for name in sorted(os.listdir(corpus)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(corpus, name), "rb") as f:
+                contents.append(f.read())
+        if len(contents) >= count:
+            break
+    return contents
+
+
+def generate_corpus(count, size):
+    rng = np.random.default_rng(0)
+    contents = []
+    for index in range(count):
+        # Smooth gradients plus noise compress like photos rather than pure noise
+        base = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+        pixels = base + rng.normal(0, 20, size=(size[1], size[0], 3))
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG" if index % 2 == 0 else "PNG", quality=90)
+        contents.append(buffer.getvalue())
+    return contents
+
+
+def decode_serial(contents):
+    return [load_image_tensor(content, False) for content in contents]
+
+
+def decode_parallel(contents, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda content: load_image_tensor(content, False), contents))
+
+
+def measure(decode, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of images, generated when omitted")
+    parser.add_argument("--count", type=int, default=32)
+    parser.add_argument("--size", type=int, nargs=2, default=(1024, 1024), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Measure decoding, not cache lookups
+    comfydeploy_utils.TENSOR_CACHE_ENABLED = False
+
+    contents = load_corpus(args.corpus, args.count) if args.corpus else generate_corpus(args.count, args.size)
+    print(f"{len(contents)} images, {sum(len(content) for content in contents) / 2 ** 20:.1f} MiB encoded, "
+          f"{os.cpu_count()} cpus")
+
+    expected = decode_serial(contents)
+    for workers in args.workers:
+        assert all(torch.equal(a, b) for a, b in zip(expected, decode_parallel(contents, workers)))
+
+    serial_time = measure(lambda: decode_serial(contents), args.repeat)
+    print(f"{'workers':>7} | {'time ms':>8} {'speedup':>7}")
+    print(f"{'serial':>7} | {serial_time * 1000:>8.1f} {1.0:>6.2f}x")
+    for workers in args.workers:
+        parallel_time = measure(lambda: decode_parallel(contents, workers), args.repeat)
+        print(f"{workers:>7} | {parallel_time * 1000:>8.1f} {serial_time / parallel_time:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
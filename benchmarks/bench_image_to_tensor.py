@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of the PIL image to IMAGE tensor conversion.
+
+Compares the previous `np.array(image).astype(np.float32) / 255.0` path with
+comfydeploy_utils.pil_to_tensor over a range of resolutions, reporting time and
+peak traced memory of a single conversion.
+
+Usage:
+    python benchmarks/bench_image_to_tensor.py [--repeat 10]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nodes"))
+from comfydeploy_utils import pil_to_tensor  # noqa: E402
+
+RESOLUTIONS = [(512, 512), (1024, 1024), (1920, 1080), (2048, 2048), (3840, 2160), (4096, 4096)]
+MODES = ["RGB", "RGBA"]
+
+
+def convert_legacy(image):
+    image = np.array(image).astype(np.float32) / 255.0
+    return torch.from_numpy(image)[None, ]
+
+
+def convert_lean(image):
+    return pil_to_tensor(image)[None, ]
+
+
+def measure(convert, image, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert(image)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = convert(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>11} {'mode':>5} | {'legacy ms':>9} {'lean ms':>8} {'speedup':>7} | "
+          f"{'legacy MiB':>10} {'lean MiB':>9} {'saved':>6}")
+    for width, height in RESOLUTIONS:
+        for mode in MODES:
+            pixels = rng.integers(0, 256, size=(height, width, len(mode)), dtype=np.uint8)
+            image = Image.fromarray(pixels, mode)
+
+            assert torch.equal(convert_legacy(image), convert_lean(image))
+
+            legacy_time, legacy_peak = measure(convert_legacy, image, args.repeat)
+            lean_time, lean_peak = measure(convert_lean, image, args.repeat)
+            print(f"{width:>5}x{height:<5} {mode:>5} | {legacy_time * 1000:>9.1f} {lean_time * 1000:>8.1f} "
+                  f"{legacy_time / lean_time:>6.2f}x | {legacy_peak / 2 ** 20:>10.1f} {lean_peak / 2 ** 20:>9.1f} "
+                  f"{1 - lean_peak / legacy_peak:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
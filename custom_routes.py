@@ -5,18 +5,45 @@
 @description: Easy deploy API for ComfyUI.
 """
 
+import os
+import re
+import json
 import uuid
 import asyncio
 import logging
+import zipfile
 import server
 import execution
+import folder_paths
+import comfy.model_management
 from aiohttp import web
 from queue import Queue
+import math
 import time
+import heapq
 import httpx
 import random
+import base64
+import hashlib
+import itertools
+import mimetypes
+from io import BytesIO
+from urllib.parse import quote
 from typing import Any, Tuple, Optional
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from comfydeploy_output_store import output_store
+from comfydeploy_utils import (
+    make_thumbnail, image_cache, tensor_cache, host_health, is_valid_url, parse_image_url_list, prefetch_image,
+    UPLOAD_SCHEME, UPLOAD_DIR, UPLOAD_TTL
+)
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
 
 
 # ========================= Configuration and Initialization =========================
@@ -26,6 +53,70 @@ class Config:
     ENABLE_VERBOSE_LOGGING = False
     # Progress update minimum interval time(seconds)
     PROGRESS_THROTTLE_INTERVAL = 0.5
+    # Output file streaming
+    OUTPUT_FILE_CACHE_MAX_AGE = 3600
+    OUTPUT_ARCHIVE_CHUNK_SIZE = 256 * 1024
+    # Raw input uploads (multipart /api/v1/upload and /api/v1/execute)
+    UPLOAD_MAX_BYTES = 200 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE = 256 * 1024
+    # Upload outputs to S3-compatible storage before task_success is sent
+    S3_UPLOAD_ENABLED = os.environ.get("COMFY_DEPLOY_S3_UPLOAD", "0") == "1"
+    S3_ENDPOINT_URL = os.environ.get("COMFY_DEPLOY_S3_ENDPOINT_URL") or None  # e.g. MinIO http://127.0.0.1:9000
+    S3_REGION = os.environ.get("COMFY_DEPLOY_S3_REGION") or None
+    S3_BUCKET = os.environ.get("COMFY_DEPLOY_S3_BUCKET", "")
+    S3_ACCESS_KEY = os.environ.get("COMFY_DEPLOY_S3_ACCESS_KEY") or None
+    S3_SECRET_KEY = os.environ.get("COMFY_DEPLOY_S3_SECRET_KEY") or None
+    S3_KEY_PREFIX = os.environ.get("COMFY_DEPLOY_S3_KEY_PREFIX", "comfy-deploy")
+    # Base URL for object URLs in result, e.g. a CDN domain. Presigned URLs are used if expires > 0
+    S3_PUBLIC_BASE_URL = os.environ.get("COMFY_DEPLOY_S3_PUBLIC_BASE_URL", "")
+    S3_PRESIGN_EXPIRES = int(os.environ.get("COMFY_DEPLOY_S3_PRESIGN_EXPIRES", "0"))
+    # Number of files uploaded at the same time
+    S3_UPLOAD_CONCURRENCY = 4
+    # Files larger than the threshold are uploaded in parts
+    S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+    S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+    S3_MULTIPART_CONCURRENCY = 4
+    # Attach small WebP previews to result.images[*].thumbnail before task_success is sent
+    THUMBNAIL_ENABLED = os.environ.get("COMFY_DEPLOY_THUMBNAILS", "0") == "1"
+    THUMBNAIL_MAX_SIDE = 256
+    THUMBNAIL_QUALITY = 75
+    # Thumbnails up to this size are inlined as base64 data URI, larger ones are served from /api/v1/blob/{key}
+    THUMBNAIL_INLINE_MAX_BYTES = 16 * 1024
+    THUMBNAIL_WORKERS = 2
+    # Maximum number of prompts one sweep request may expand to
+    SWEEP_MAX_PROMPTS = 256
+    # Weighted fair sharing of the queue between tenants of API prompts, weights as JSON {"tenant": weight}.
+    # Fair-share numbers start from the head of the waiting queue and may overtake web UI prompts
+    FAIR_SHARE_ENABLED = os.environ.get("COMFY_DEPLOY_FAIR_SHARE", "0") == "1"
+    TENANT_WEIGHTS = json.loads(os.environ.get("COMFY_DEPLOY_TENANT_WEIGHTS", "{}"))
+    DEFAULT_TENANT = "default"
+    # Queue positions a prompt moves ahead per priority level
+    PRIORITY_STEP = 100
+    # Admission control, /api/v1/execute answers 429 beyond these limits (0 disables a limit)
+    MAX_QUEUE_DEPTH = int(os.environ.get("COMFY_DEPLOY_MAX_QUEUE_DEPTH", "0"))
+    MAX_CLIENT_IN_FLIGHT = int(os.environ.get("COMFY_DEPLOY_MAX_CLIENT_IN_FLIGHT", "0"))
+    # Retry-After bounds (seconds), derived from the completion rate of recent tasks
+    RETRY_AFTER_DEFAULT = 30
+    RETRY_AFTER_MAX = 600
+    THROUGHPUT_WINDOW = 50
+    # Run waiting API prompts that use the models of the running prompt first, within the first
+    # MODEL_AFFINITY_WINDOW waiting prompts. A prompt is overtaken by at most MODEL_AFFINITY_MAX_BYPASS prompts
+    MODEL_AFFINITY_ENABLED = os.environ.get("COMFY_DEPLOY_MODEL_AFFINITY", "0") == "1"
+    MODEL_AFFINITY_WINDOW = 16
+    MODEL_AFFINITY_MAX_BYPASS = 3
+    # Identical prompts (after the seed policy) attach to a queued/running task or reuse a recent result.
+    # The answer then carries the prompt_id of the other task, so clients opt in
+    DEDUPE_ENABLED = os.environ.get("COMFY_DEPLOY_DEDUPE", "0") == "1"
+    DEDUPE_RESULT_TTL = int(os.environ.get("COMFY_DEPLOY_DEDUPE_RESULT_TTL", "300"))
+    DEDUPE_RESULT_CACHE_SIZE = 256
+    # task_ids of attached or cached duplicates remembered so retries are answered as known tasks
+    DEDUPE_ALIAS_CACHE_SIZE = 4096
+    # Tasks given a deadline/timeout are dropped from the waiting queue once it passes, running tasks past
+    # their deadline are interrupted only if enabled here or by interrupt_expired in the request
+    DEADLINE_INTERRUPT_RUNNING = os.environ.get("COMFY_DEPLOY_DEADLINE_INTERRUPT", "0") == "1"
+    DEADLINE_CHECK_INTERVAL = 1.0
+    # Interval (seconds) of the check for API tasks removed through ComfyUI's own /queue delete or clear
+    STALE_TASK_CHECK_INTERVAL = 10.0
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -52,13 +143,44 @@ class TaskManager:
 
         # API created tasks list
         self.api_created_tasks = set()  # store task IDs created through API
+        self.pending_tasks = set()  # task IDs reserved by submissions that are still being validated
 
         # Store task outputs
-        self.execution_outputs = {}  # prompt_id -> {outputs: {}}
+        self.execution_outputs = {}  # prompt_id -> {outputs: {}, result: {images, videos, 3d}}
 
         # Track queued event sent status to prevent duplicate sends
         self.queued_event_sent = set()  # store prompt_ids that have already sent task_queued event
 
+        # Parameter sweeps, member results are aggregated into one callback
+        self.sweeps = {}  # sweep_id -> {client_id, tasks: [{prompt_id, params}], results: {prompt_id: result}}
+        self.prompt_sweeps = {}  # prompt_id -> sweep_id
+
+        # Fair-share scheduling
+        self.tenant_pass = {}  # tenant -> queue number its next prompt starts from
+        self.last_queue_number = 0  # highest fair-share queue number assigned
+
+        # Admission control
+        self.client_tasks = defaultdict(set)  # client_id -> prompt_ids queued or running
+        self.task_clients = {}  # prompt_id -> client_id, kept until the task is released
+        self.completion_times = deque(maxlen=Config.THROUGHPUT_WINDOW)  # finish time of recent tasks
+
+        # Model affinity scheduling
+        self.affinity_bypass = {}  # prompt_id -> times the prompt was overtaken by a reorder
+        self.task_priorities = {}  # prompt_id -> priority of the queue number, None if queued at the front
+
+        # Deduplication of identical prompts
+        self.prompt_hashes = {}  # prompt hash -> prompt_id queued or running
+        self.task_hashes = {}  # prompt_id -> prompt hash
+        # prompt_id -> {caller: (client_id, callback URL or None)} of attached duplicates, the caller is the
+        # task_id of the duplicate or its client_id
+        self.attached_callers = defaultdict(dict)
+        self.result_cache = OrderedDict()  # prompt hash -> (finish time, prompt_id, result, raw_outputs)
+        self.task_aliases = OrderedDict()  # task_id of an attached or cached duplicate -> prompt_id it resolved to
+
+        # Task deadlines, a heap with lazy deletion: entries of finished tasks are skipped when popped
+        self.deadline_heap = []  # (deadline, prompt_id)
+        self.task_deadlines = {}  # prompt_id -> (deadline, interrupt running task)
+
     def is_api_task(self, prompt_id: str) -> bool:
         if prompt_id in self.api_created_tasks:
             return True
@@ -72,6 +194,156 @@ class TaskManager:
 
         return False
 
+    def init_outputs(self, prompt_id: str) -> None:
+        self.execution_outputs[prompt_id] = {'outputs': {}, 'result': new_result_index()}
+
+    def record_output(self, prompt_id: str, node_id: str, output: dict) -> None:
+        """
+        Record the output of an executed node and classify it into the result index
+
+        Parameters:
+            prompt_id: task ID
+            node_id: node ID
+            output: node output (the `output` field of the executed event)
+        """
+        if prompt_id not in self.execution_outputs:
+            self.init_outputs(prompt_id)
+        history_data = self.execution_outputs[prompt_id]
+        outputs = history_data['outputs']
+        output = output or {}
+
+        if node_id in outputs:
+            # A node executed twice in one task, rebuild the index so its old output is not counted again
+            outputs[node_id] = output
+            result = new_result_index()
+            for node_output in outputs.values():
+                classify_output(node_output, result)
+            history_data['result'] = result
+        else:
+            outputs[node_id] = output
+            classify_output(output, history_data['result'])
+
+    def get_task_result(self, prompt_id: str) -> Tuple[dict, dict]:
+        """
+        Get the indexed result and raw outputs of a task
+
+        Returns:
+            Tuple (result, raw_outputs)
+        """
+        history_data = self.execution_outputs.get(prompt_id)
+        if not history_data:
+            return new_result_index(), {}
+        return history_data['result'], history_data['outputs']
+
+    def add_sweep(self, sweep_id: str, client_id: str, tasks: list) -> None:
+        self.sweeps[sweep_id] = {"client_id": client_id, "tasks": tasks, "results": {}}
+        for task in tasks:
+            self.prompt_sweeps[task["prompt_id"]] = sweep_id
+
+    def discard_sweep(self, sweep_id: str) -> None:
+        sweep = self.sweeps.pop(sweep_id, None)
+        self.callback_urls.pop(sweep_id, None)
+        if sweep is not None:
+            for task in sweep["tasks"]:
+                self.prompt_sweeps.pop(task["prompt_id"], None)
+
+    def record_sweep_result(self, prompt_id: str, result: dict) -> Optional[str]:
+        """
+        Record the final state of a sweep member
+
+        Returns:
+            The sweep ID if this was the last pending member, otherwise None
+        """
+        sweep_id = self.prompt_sweeps.pop(prompt_id, None)
+        sweep = self.sweeps.get(sweep_id)
+        if sweep is None:
+            return None
+        sweep["results"][prompt_id] = result
+        return sweep_id if len(sweep["results"]) == len(sweep["tasks"]) else None
+
+    def add_in_flight(self, prompt_id: str, client_id: str) -> None:
+        self.client_tasks[client_id].add(prompt_id)
+        self.task_clients[prompt_id] = client_id
+
+    def release_in_flight(self, prompt_id: str) -> None:
+        client_id = self.task_clients.pop(prompt_id, None)
+        if client_id is None:
+            return
+        tasks = self.client_tasks.get(client_id)
+        if tasks is not None:
+            tasks.discard(prompt_id)
+            if not tasks:
+                del self.client_tasks[client_id]
+
+    def get_throughput(self) -> Optional[float]:
+        """Completed tasks per second over the recent window, None until two tasks finished"""
+        if len(self.completion_times) < 2:
+            return None
+        elapsed = self.completion_times[-1] - self.completion_times[0]
+        return (len(self.completion_times) - 1) / elapsed if elapsed > 0 else None
+
+    def track_prompt_hash(self, prompt_hash: str, prompt_id: str) -> None:
+        self.prompt_hashes[prompt_hash] = prompt_id
+        self.task_hashes[prompt_id] = prompt_hash
+
+    def release_prompt_hash(self, prompt_id: str, task_result: Optional[Tuple] = None) -> None:
+        """Forget the hash of a finished task, successful results are kept in the result cache"""
+        prompt_hash = self.task_hashes.pop(prompt_id, None)
+        if prompt_hash is None:
+            return
+        if self.prompt_hashes.get(prompt_hash) == prompt_id:
+            del self.prompt_hashes[prompt_hash]
+        if task_result is not None and Config.DEDUPE_RESULT_TTL > 0:
+            self.result_cache[prompt_hash] = (time.time(), prompt_id, task_result[0], task_result[1])
+            self.result_cache.move_to_end(prompt_hash)
+            while len(self.result_cache) > Config.DEDUPE_RESULT_CACHE_SIZE:
+                self.result_cache.popitem(last=False)
+
+    def get_cached_result(self, prompt_hash: str) -> Optional[Tuple]:
+        """
+        Returns:
+            Tuple (prompt_id, result, raw_outputs) of a result younger than DEDUPE_RESULT_TTL, or None
+        """
+        entry = self.result_cache.get(prompt_hash)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > Config.DEDUPE_RESULT_TTL:
+            del self.result_cache[prompt_hash]
+            return None
+        return entry[1:]
+
+    def get_callback_urls(self, prompt_id: str) -> list:
+        """Callback URL of the task followed by the distinct URLs of attached duplicates"""
+        callback_urls = [self.callback_urls[prompt_id]] if prompt_id in self.callback_urls else []
+        for _, callback_url in self.attached_callers.get(prompt_id, {}).values():
+            if callback_url and callback_url not in callback_urls:
+                callback_urls.append(callback_url)
+        return callback_urls
+
+    def add_task_alias(self, task_id: str, prompt_id: str) -> None:
+        self.task_aliases[task_id] = prompt_id
+        self.task_aliases.move_to_end(task_id)
+        while len(self.task_aliases) > Config.DEDUPE_ALIAS_CACHE_SIZE:
+            self.task_aliases.popitem(last=False)
+
+    def set_deadline(self, prompt_id: str, deadline: float, interrupt: bool) -> None:
+        self.task_deadlines[prompt_id] = (deadline, interrupt)
+        heapq.heappush(self.deadline_heap, (deadline, prompt_id))
+
+    def pop_expired(self, now: float) -> list:
+        """
+        Returns:
+            List of (prompt_id, interrupt) of tracked tasks whose deadline passed
+        """
+        expired = []
+        while self.deadline_heap and self.deadline_heap[0][0] <= now:
+            deadline, prompt_id = heapq.heappop(self.deadline_heap)
+            entry = self.task_deadlines.get(prompt_id)
+            if entry is not None and entry[0] == deadline:
+                del self.task_deadlines[prompt_id]
+                expired.append((prompt_id, entry[1]))
+        return expired
+
     def cleanup_task(self, prompt_id: str, client_id: str) -> None:
         self.workflow_nodes.pop(prompt_id, None)
         self.workflow_progress.pop(prompt_id, None)
@@ -84,6 +356,11 @@ class TaskManager:
             self.api_created_tasks.remove(prompt_id)
 
         self.execution_outputs.pop(prompt_id, None)
+        self.release_in_flight(prompt_id)
+        self.affinity_bypass.pop(prompt_id, None)
+        self.task_priorities.pop(prompt_id, None)
+        self.attached_callers.pop(prompt_id, None)
+        self.task_deadlines.pop(prompt_id, None)
 
         if prompt_id in self.queued_event_sent:
             self.queued_event_sent.remove(prompt_id)
@@ -103,6 +380,31 @@ class WebSocketManager:
         self.ws_event_queue = Queue()
 
 
+def new_result_index() -> dict:
+    return {'images': [], 'videos': [], '3d': []}
+
+
+def classify_output(output: dict, result: dict) -> None:
+    """
+    Classify the output items of one node into the result index by key name
+
+    Parameters:
+        output: node output, e.g. {"images": [{"filename": ..., "subfolder": ..., "type": ...}]}
+        result: result index to extend
+    """
+    if not output:
+        return
+    for k, v in output.items():
+        if not isinstance(v, list):
+            continue
+        if 'images' in k or 'gifs' in k:
+            result['images'].extend(v)
+        elif 'videos' in k:
+            result['videos'].extend(v)
+        elif '3d' in k:
+            result['3d'].extend(v)
+
+
 config = Config()
 task_manager = TaskManager()
 ws_manager = WebSocketManager()
@@ -247,22 +549,68 @@ def handle_execution_events_with_ws_and_callback(event_name: str, data: dict) ->
                 logger.warning(f"[Event handling] Event {event_name} has no associated prompt_id or client_id")
         return
 
+    if event_name == "execution_start" and prompt_id in task_manager.task_deadlines:
+        # Started between two deadline checks after its deadline passed, stop it before it uses the GPU
+        if task_manager.task_deadlines[prompt_id][0] <= time.time():
+            task_manager.task_deadlines.pop(prompt_id, None)
+            cancel_task(prompt_id, "task_expired", message="Task deadline passed before it started")
+            return
+
+    if event_name == "execution_start" and config.MODEL_AFFINITY_ENABLED:
+        reorder_queue_by_model_affinity(prompt_id)
+
+    # Every finished task counts towards the measured throughput, not only API tasks
+    if event_name in ["execution_success", "execution_error", "execution_interrupted"]:
+        task_manager.release_in_flight(prompt_id)
+        task_manager.completion_times.append(time.time())
+        task_manager.task_deadlines.pop(prompt_id, None)
+        if event_name != "execution_success":
+            task_manager.release_prompt_hash(prompt_id)
+
     if not task_manager.is_api_task(prompt_id):
         return
 
     # API Callback
     _update_workflow_progress(event_name, prompt_id, client_id, data)
-    callback_data = _prepare_callback_data(event_name, prompt_id, client_id, data)
 
+    # Terminal result is taken from the output index once and shared by the callback and WebSocket paths
+    task_result = None
+    if event_name == "execution_success":
+        task_result = task_manager.get_task_result(prompt_id)
+        data = {**data, "result": task_result[0], "raw_outputs": task_result[1]}
+        task_manager.release_prompt_hash(prompt_id, task_result)
+
+    callback_data = _prepare_callback_data(event_name, prompt_id, client_id, data, task_result)
+
+    events = []
     if callback_data:
         callback_event, event_data = callback_data
 
-        if callback_event and event_data and prompt_id in task_manager.callback_urls:
-            ws_manager.ws_event_queue.put((prompt_id, "callback", (callback_event, event_data)))
+        if callback_event and event_data and task_manager.get_callback_urls(prompt_id):
+            events.append((prompt_id, "callback", (callback_event, event_data)))
 
     if event_name in ["execution_success", "execution_error"]:
         if client_id and client_id in task_manager.client_prompts:
-            ws_manager.ws_event_queue.put((prompt_id, event_name, data))
+            events.append((prompt_id, event_name, data))
+
+        if prompt_id in task_manager.prompt_sweeps:
+            if event_name == "execution_success":
+                sweep_result = {"status": "success", "result": task_result[0], "raw_outputs": task_result[1]}
+            else:
+                sweep_result = {"status": "failed", "error": data.get("exception_message", "unknown error")}
+            events.append((prompt_id, "sweep_result", sweep_result))
+
+    if event_name == "execution_interrupted" and prompt_id in task_manager.prompt_sweeps:
+        # After cancel_task the member already reported its result, this one finds the sweep done with it
+        events.append((prompt_id, "sweep_result", {"status": "cancelled", "error": "Task interrupted"}))
+
+    if event_name == "execution_success" and events and (config.THUMBNAIL_ENABLED or config.S3_UPLOAD_ENABLED):
+        # Post-process outputs first, the success events are queued once thumbnails and URLs are in the result
+        ws_manager.ws_event_queue.put((prompt_id, "finalize_outputs", (task_result[0], events)))
+        return
+
+    for event in events:
+        ws_manager.ws_event_queue.put(event)
 
 
 def _update_workflow_progress(event_name: str, prompt_id: str, client_id: str, data: dict) -> None:
@@ -326,7 +674,7 @@ def _update_workflow_progress(event_name: str, prompt_id: str, client_id: str, d
                 "node_progress": {}, "execution_order": []
             }
 
-        task_manager.execution_outputs[prompt_id] = {'outputs': {}}
+        task_manager.init_outputs(prompt_id)
 
     elif event_name == "execution_cached":
         try:
@@ -396,7 +744,7 @@ def _update_workflow_progress(event_name: str, prompt_id: str, client_id: str, d
                 "node_progress": {}, "execution_order": []
             }
 
-        task_manager.execution_outputs[prompt_id] = {'outputs': {}}
+        task_manager.init_outputs(prompt_id)
 
     elif event_name == "executing":
         # Node started executing
@@ -437,7 +785,7 @@ def _update_workflow_progress(event_name: str, prompt_id: str, client_id: str, d
                 "value": 100, "max": 100, "percent": 100
             }
 
-            task_manager.execution_outputs[prompt_id]['outputs'][node] = data.get('output', {})
+            task_manager.record_output(prompt_id, node, data.get('output', {}))
 
             logger.info(
                 f"[comfy-deploy] Task {prompt_id} node {node} executed, total progress: "
@@ -453,7 +801,8 @@ def _update_workflow_progress(event_name: str, prompt_id: str, client_id: str, d
         logger.info(f"[comfy-deploy] Task {prompt_id} execution ended! Status: {event_name}")
 
 
-def _prepare_callback_data(event_name: str, prompt_id: str, client_id: str, data: dict) -> Optional[Tuple]:
+def _prepare_callback_data(event_name: str, prompt_id: str, client_id: str, data: dict,
+                           task_result: Optional[Tuple] = None) -> Optional[Tuple]:
     """
     Prepare callback data based on event type
 
@@ -462,6 +811,7 @@ def _prepare_callback_data(event_name: str, prompt_id: str, client_id: str, data
         prompt_id: task ID
         client_id: client ID
         data: event data
+        task_result: optional (result, raw_outputs) already taken from the output index
 
     Returns:
         Tuple (callback_event, callback_data) or None
@@ -487,25 +837,11 @@ def _prepare_callback_data(event_name: str, prompt_id: str, client_id: str, data
         is_success = event_name == "execution_success"
         error_msg = data.get("exception_message", "unknown error") if not is_success else None
 
-        result_data = {'images': [], 'videos': [], '3d': []}
-        outputs = {}
+        result_data, outputs = {}, {}
         if is_success:
-            try:
-                history_data = task_manager.execution_outputs[prompt_id]
-                outputs = history_data.get('outputs', {})
-                for output in outputs.values():
-                    if output:
-                        for k, v in output.items():
-                            if 'images' in k or 'gifs' in k:
-                                result_data['images'].extend(v)
-                            elif 'videos' in k:
-                                result_data['videos'].extend(v)
-                            elif '3d' in k:
-                                result_data['3d'].extend(v)
-                if check_verbose_logging():
-                    logger.info(f"[Event handling] Get output of task {prompt_id}: {len(outputs)} nodes")
-            except Exception as e:
-                logger.error(f"[Event handling] Error getting output of task {prompt_id}: {str(e)}")
+            result_data, outputs = task_result or task_manager.get_task_result(prompt_id)
+            if check_verbose_logging():
+                logger.info(f"[Event handling] Get output of task {prompt_id}: {len(outputs)} nodes")
 
         if is_success:
             callback_event = "task_success"
@@ -547,7 +883,9 @@ def send_workflow_progress_callback(prompt_id: str, client_id: str) -> None:
         prompt_id: task ID
         client_id: client ID
     """
-    if prompt_id not in task_manager.workflow_progress or prompt_id not in task_manager.callback_urls:
+    if prompt_id not in task_manager.workflow_progress:
+        return
+    if not task_manager.get_callback_urls(prompt_id):
         return
 
     current_time = time.time()
@@ -720,6 +1058,373 @@ def is_task_in_waiting_queue(prompt_id: str) -> bool:
         return True
 
 
+def is_task_running(prompt_id: str) -> bool:
+    prompt_queue = server.PromptServer.instance.prompt_queue
+    with prompt_queue.mutex:
+        return any(item[1] == prompt_id for item in prompt_queue.currently_running.values())
+
+
+def get_request_deadline(json_data: dict) -> Optional[float]:
+    """
+    Absolute deadline of a submission from deadline (unix timestamp) or timeout (seconds from now)
+
+    Raises:
+        ValueError: if the value is not a number or the deadline already passed
+    """
+    if json_data.get("deadline") is not None:
+        deadline = float(json_data["deadline"])
+    elif json_data.get("timeout") is not None:
+        timeout = float(json_data["timeout"])
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        deadline = time.time() + timeout
+    else:
+        return None
+    if deadline <= time.time():
+        raise ValueError("deadline already passed")
+    return deadline
+
+
+def get_request_bool(json_data: dict, key: str, default: bool) -> bool:
+    """
+    Boolean option of a submission, a JSON boolean or one of the strings true/false/1/0
+
+    Raises:
+        ValueError: if the value is anything else
+    """
+    value = json_data.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "1"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0"):
+        return False
+    raise ValueError(f"{key} must be a boolean")
+
+
+def get_prompt_hash(prompt: dict) -> str:
+    """Hash of a canonical prompt, node titles in _meta do not change the result and are left out"""
+    canonical = {
+        node_id: {key: value for key, value in node_data.items() if key != "_meta"}
+        if isinstance(node_data, dict) else node_data
+        for node_id, node_data in prompt.items()
+    }
+    return hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def is_known_task(prompt_id: str) -> bool:
+    """Check if a task ID was already submitted and is still queued, running, tracked or in history"""
+    if prompt_id in task_manager.api_created_tasks or prompt_id in task_manager.sweeps:
+        return True
+    if prompt_id in task_manager.pending_tasks or prompt_id in task_manager.task_aliases:
+        return True
+    try:
+        return bool(server.PromptServer.instance.prompt_queue.get_history(prompt_id))
+    except Exception:
+        return False
+
+
+def attach_duplicate_prompt(prompt_hash: str, client_id: str, callback_url: str = None,
+                            task_id: str = None) -> Optional[web.Response]:
+    """
+    Answer a submission identical to a queued, running or recently finished task
+
+    A duplicate of a queued or running task attaches to it, its callback URL also receives the task
+    callbacks and its client_id the machine WebSocket events of the task. A duplicate of a task finished within DEDUPE_RESULT_TTL gets the stored result at once.
+    The task_id of the duplicate is remembered as an alias, a retry with it is answered as a known task
+
+    Returns:
+        Response for the duplicate, or None if the prompt has to be queued
+    """
+    prompt_id = task_manager.prompt_hashes.get(prompt_hash)
+    if prompt_id is not None:
+        if task_id and task_id != prompt_id:
+            task_manager.add_task_alias(task_id, prompt_id)
+        # A retry with the same task_id or client_id replaces its entry instead of adding another one
+        task_manager.attached_callers[prompt_id][task_id or client_id] = (client_id, callback_url)
+        if client_id in ws_manager.machine_listeners or client_id in ws_manager.machine_prompts:
+            ws_manager.machine_prompts[client_id].add(prompt_id)
+        logger.info(f"[comfy-deploy] Identical prompt already queued or running, attach to task {prompt_id}")
+        return web.json_response({"prompt_id": prompt_id, "client_id": client_id, "status": "attached"})
+
+    cached = task_manager.get_cached_result(prompt_hash)
+    if cached is None:
+        return None
+
+    prompt_id, result, raw_outputs = cached
+    if task_id and task_id != prompt_id:
+        task_manager.add_task_alias(task_id, prompt_id)
+    logger.info(f"[comfy-deploy] Identical prompt finished recently, reuse result of task {prompt_id}")
+    if callback_url:
+        # Posted directly, the finished task has no state left for send_callback to clean up
+        asyncio.create_task(post_callback(callback_url, "task_success", {
+            "prompt_id": prompt_id,
+            "client_id": client_id,
+            "status": "success",
+            "progress": 100,
+            "message": "Task result reused from an identical task",
+            "result": result,
+            "raw_outputs": raw_outputs,
+            "cached": True,
+            "timestamp": int(time.time())
+        }))
+    return web.json_response({
+        "prompt_id": prompt_id,
+        "client_id": client_id,
+        "status": "cached",
+        "result": result,
+        "raw_outputs": raw_outputs
+    })
+
+
+def release_rejected_submission(prompt_id: str, message: str) -> None:
+    """
+    Release the task ID and prompt hash reserved by a submission that was not queued
+
+    Duplicates that attached to it while it was validated are told that the task failed
+    """
+    task_manager.pending_tasks.discard(prompt_id)
+    task_manager.release_prompt_hash(prompt_id)
+    task_manager.callback_urls.pop(prompt_id, None)
+    for alias in [alias for alias, target in task_manager.task_aliases.items() if target == prompt_id]:
+        del task_manager.task_aliases[alias]
+    for client_id, callback_url in task_manager.attached_callers.pop(prompt_id, {}).values():
+        if callback_url:
+            asyncio.create_task(post_callback(callback_url, "task_failed", {
+                "prompt_id": prompt_id,
+                "client_id": client_id,
+                "status": "failed",
+                "progress": 0,
+                "message": message,
+                "timestamp": int(time.time())
+            }))
+
+
+def reconcile_in_flight(client_id: str = None) -> None:
+    """
+    Release in-flight tasks of a client (of every client if not given) that are neither waiting nor running
+
+    Tasks removed through ComfyUI's own /queue delete or clear send no execution event, so the in-flight
+    set is checked against the queue instead of trusting events only. Sweep members report a cancelled
+    result so their sweep still completes, other tasks are cleaned up
+    """
+    if client_id is None:
+        tasks = set(task_manager.task_clients)
+    else:
+        tasks = set(task_manager.client_tasks.get(client_id, ()))
+    if not tasks:
+        return
+    prompt_queue = server.PromptServer.instance.prompt_queue
+    with prompt_queue.mutex:
+        live = {item[1] for item in prompt_queue.queue}
+        live.update(item[1] for item in prompt_queue.currently_running.values())
+    for prompt_id in tasks - live:
+        logger.info(f"[comfy-deploy] Task {prompt_id} left the queue without a terminal event, release it")
+        task_manager.release_in_flight(prompt_id)
+        task_manager.release_prompt_hash(prompt_id)
+        if prompt_id in task_manager.prompt_sweeps:
+            ws_manager.ws_event_queue.put((prompt_id, "sweep_result", {
+                "status": "cancelled", "error": "Task removed from the queue"
+            }))
+        else:
+            ws_manager.ws_event_queue.put((prompt_id, "task_cleanup", task_manager.prompts_client.get(prompt_id)))
+
+
+def check_admission(client_id: str, count: int = 1) -> Optional[web.Response]:
+    """
+    Check the queue depth and the in-flight tasks of a client before prompts are queued
+
+    Parameters:
+        client_id: client submitting the prompts
+        count: number of prompts of the submission
+
+    Returns:
+        429 response with Retry-After if a limit would be exceeded, otherwise None
+    """
+    prompt_server = server.PromptServer.instance
+    excess = 0
+    reason = None
+    if config.MAX_QUEUE_DEPTH > 0:
+        queue_depth = prompt_server.prompt_queue.get_tasks_remaining()
+        if queue_depth + count > config.MAX_QUEUE_DEPTH:
+            excess = queue_depth + count - config.MAX_QUEUE_DEPTH
+            reason = f"Queue is full ({queue_depth}/{config.MAX_QUEUE_DEPTH} tasks, {count} more submitted)"
+    if reason is None and config.MAX_CLIENT_IN_FLIGHT > 0:
+        reconcile_in_flight(client_id)
+        in_flight = len(task_manager.client_tasks.get(client_id, ()))
+        if in_flight + count > config.MAX_CLIENT_IN_FLIGHT:
+            excess = in_flight + count - config.MAX_CLIENT_IN_FLIGHT
+            reason = (f"Client {client_id} has {in_flight}/{config.MAX_CLIENT_IN_FLIGHT} tasks in flight, "
+                      f"{count} more submitted")
+    if reason is None:
+        return None
+
+    # Time until enough tasks finished at the measured completion rate
+    throughput = task_manager.get_throughput()
+    if throughput:
+        retry_after = min(config.RETRY_AFTER_MAX, max(1, math.ceil(excess / throughput)))
+    else:
+        retry_after = config.RETRY_AFTER_DEFAULT
+    logger.warning(f"[comfy-deploy] Reject submission of {count} tasks: {reason}, retry after {retry_after}s")
+    return web.json_response(
+        {"error": reason, "retry_after": retry_after},
+        status=429,
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def get_queue_number(tenant: str = None, priority: int = 0, front: bool = False) -> float:
+    """
+    Get the queue number of a new API prompt, the waiting queue is a heap ordered by number
+
+    With fair sharing every tenant advances its own pass by 1 / weight per prompt, starting no earlier
+    than the head of the waiting queue. A tenant flooding the queue only pushes its own prompts back,
+    prompts of other tenants are interleaved in proportion to their weights
+
+    Parameters:
+        tenant: tenant of the prompt, DEFAULT_TENANT if not given
+        priority: each level moves the prompt PRIORITY_STEP positions ahead
+        front: place the prompt before every waiting prompt
+
+    Returns:
+        Queue number
+    """
+    prompt_server = server.PromptServer.instance
+    fifo_number = prompt_server.number
+    prompt_server.number += 1
+    if not config.FAIR_SHARE_ENABLED and not priority and not front:
+        return fifo_number
+
+    prompt_queue = prompt_server.prompt_queue
+    # The head must not change until the number is computed, callers also hold the mutex until the put
+    with prompt_queue.mutex:
+        head_number = prompt_queue.queue[0][0] if prompt_queue.queue else None
+
+        if config.FAIR_SHARE_ENABLED:
+            tenant = tenant or config.DEFAULT_TENANT
+            weight = max(float(config.TENANT_WEIGHTS.get(tenant, 1)), 0.01)
+            # An idle queue starts everyone from the latest number, no tenant keeps credit from idle time
+            virtual_now = (head_number if head_number is not None
+                           else max(task_manager.last_queue_number, fifo_number))
+            start = max(virtual_now, task_manager.tenant_pass.get(tenant, virtual_now))
+            task_manager.tenant_pass[tenant] = start + 1.0 / weight
+            task_manager.last_queue_number = max(task_manager.last_queue_number, start)
+            number = start
+        else:
+            number = fifo_number
+
+        if front:
+            return (head_number if head_number is not None else number) - 1
+        return number - priority * config.PRIORITY_STEP
+
+
+# Loader nodes and the inputs naming the model they load
+MODEL_LOADER_INPUTS = {
+    "CheckpointLoaderSimple": ("ckpt_name",),
+    "CheckpointLoader": ("ckpt_name",),
+    "ImageOnlyCheckpointLoader": ("ckpt_name",),
+    "UNETLoader": ("unet_name",),
+    "VAELoader": ("vae_name",),
+    "CLIPLoader": ("clip_name",),
+    "DualCLIPLoader": ("clip_name1", "clip_name2"),
+    "TripleCLIPLoader": ("clip_name1", "clip_name2", "clip_name3"),
+    "CLIPVisionLoader": ("clip_name",),
+    "LoraLoader": ("lora_name",),
+    "LoraLoaderModelOnly": ("lora_name",),
+    "ControlNetLoader": ("control_net_name",),
+    "UpscaleModelLoader": ("model_name",),
+}
+
+
+def get_prompt_models(prompt: dict) -> set:
+    """Models loaded by a prompt, as (loader class_type, model name) pairs"""
+    models = set()
+    for node_data in prompt.values():
+        if not isinstance(node_data, dict):
+            continue
+        input_names = MODEL_LOADER_INPUTS.get(node_data.get("class_type"))
+        if not input_names:
+            continue
+        inputs = node_data.get("inputs") or {}
+        for input_name in input_names:
+            value = inputs.get(input_name)
+            if isinstance(value, str):
+                models.add((node_data["class_type"], value))
+    return models
+
+
+def reorder_queue_by_model_affinity(running_prompt_id: str) -> None:
+    """
+    Move waiting API prompts that share models with the running prompt ahead of the others
+
+    Only the first MODEL_AFFINITY_WINDOW waiting prompts are considered, and API prompts only swap queue
+    numbers with API prompts of the same priority, so other prompts keep their positions and prompts queued
+    with front are never moved. A prompt overtaken by MODEL_AFFINITY_MAX_BYPASS prompts is not overtaken again
+
+    Parameters:
+        running_prompt_id: prompt that just started executing, its models are the loaded ones
+    """
+    prompt_queue = server.PromptServer.instance.prompt_queue
+    try:
+        with prompt_queue.mutex:
+            running_models = set()
+            for item in prompt_queue.currently_running.values():
+                if item[1] == running_prompt_id:
+                    running_models = get_prompt_models(item[2])
+                    break
+            if not running_models or len(prompt_queue.queue) < 2:
+                return
+
+            window = sorted(prompt_queue.queue)[:config.MODEL_AFFINITY_WINDOW]
+            bands = defaultdict(list)  # priority -> API items of that priority in queue order
+            for item in window:
+                if item[1] in task_manager.api_created_tasks:
+                    priority = task_manager.task_priorities.get(item[1], 0)
+                    if priority is not None:
+                        bands[priority].append(item)
+
+            replaced = {}
+            for api_items in bands.values():
+                if len(api_items) < 2:
+                    continue
+                # Greedy pick: the best matching prompt goes next unless an earlier one used up its bypass budget
+                scores = {item[1]: len(get_prompt_models(item[2]) & running_models) for item in api_items}
+                remaining = list(api_items)
+                reordered = []
+                while remaining:
+                    pick = max(remaining, key=lambda item: scores[item[1]])
+                    for item in remaining[:remaining.index(pick)]:
+                        if task_manager.affinity_bypass.get(item[1], 0) >= config.MODEL_AFFINITY_MAX_BYPASS:
+                            pick = item
+                            break
+                    for item in remaining[:remaining.index(pick)]:
+                        task_manager.affinity_bypass[item[1]] = task_manager.affinity_bypass.get(item[1], 0) + 1
+                    remaining.remove(pick)
+                    reordered.append(pick)
+                if reordered == api_items:
+                    continue
+
+                numbers = [item[0] for item in api_items]
+                replaced.update(
+                    {item[1]: (numbers[position],) + tuple(item[1:]) for position, item in enumerate(reordered)}
+                )
+            if not replaced:
+                return
+
+            prompt_queue.queue[:] = [replaced.get(item[1], item) for item in prompt_queue.queue]
+            heapq.heapify(prompt_queue.queue)
+            next_prompt_id = min(prompt_queue.queue)[1]
+
+        logger.info(f"[comfy-deploy] Reordered {len(replaced)} waiting tasks by model affinity with "
+                    f"{running_prompt_id}, next: {next_prompt_id}")
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Model affinity reorder failed: {str(e)}")
+
+
 def random_seed(length=15):
     if length==15:
         return random.randint(0, 1125899906842624)
@@ -747,7 +1452,127 @@ def apply_random_seed_to_workflow(workflow_api):
                     )
 
 
-async def execute_prompt(prompt: dict, client_id: str = None, pre_prompt_id: str = None) -> str:
+def prefetch_prompt_images(prompt: dict) -> None:
+    """
+    Start background downloads of the image urls given to External Image nodes of a prompt
+
+    Parameters:
+        prompt: ComfyUI workflow JSON
+    """
+    urls = []
+    for node_data in prompt.values():
+        if not isinstance(node_data, dict):
+            continue
+        class_type = node_data.get("class_type")
+        inputs = node_data.get("inputs") or {}
+        try:
+            if class_type == "ComfyDeployExternalImage":
+                urls.append(inputs.get("param_name"))
+            elif class_type == "ComfyDeployExternalImageBatch":
+                urls.extend(parse_image_url_list(inputs.get("default_value") or []))
+        except ValueError:
+            continue
+
+    for url in urls:
+        if isinstance(url, str) and url.startswith("http") and is_valid_url(url):
+            prefetch_image(url)
+
+
+async def stage_upload_part(part) -> Tuple[str, int]:
+    """
+    Stream one multipart file part to a spool file in the upload directory
+
+    Returns:
+        Tuple (upload handle, size in bytes)
+
+    Raises:
+        ValueError: if the part is larger than UPLOAD_MAX_BYTES
+    """
+    cleanup_expired_uploads()
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_DIR, upload_id)
+    tmp_path = f"{path}.part"
+    size = 0
+    # File IO runs in the default executor, uploads may be hundreds of MB and must not block the event loop
+    loop = asyncio.get_running_loop()
+    try:
+        f = await loop.run_in_executor(None, open, tmp_path, "wb")
+        try:
+            while chunk := await part.read_chunk(config.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > config.UPLOAD_MAX_BYTES:
+                    raise ValueError(f"Upload {part.filename} exceeds {config.UPLOAD_MAX_BYTES} bytes")
+                await loop.run_in_executor(None, f.write, chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    logger.info(f"[comfy-deploy] Staged upload {part.filename} ({size} bytes) as {UPLOAD_SCHEME}{upload_id}")
+    return f"{UPLOAD_SCHEME}{upload_id}", size
+
+
+def cleanup_expired_uploads() -> None:
+    try:
+        expire_time = time.time() - UPLOAD_TTL
+        for entry in os.scandir(UPLOAD_DIR):
+            if entry.is_file() and entry.stat().st_mtime < expire_time:
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+
+async def read_multipart_execute_request(request) -> dict:
+    """
+    Read a multipart /api/v1/execute request: a JSON `payload` part with the usual fields plus file parts.
+    Prompt values `upload://<field name>` are replaced with the handle of the file part of that name
+
+    Returns:
+        Request JSON data
+    """
+    json_data = {}
+    handles = {}
+    reader = await request.multipart()
+    try:
+        while (part := await reader.next()) is not None:
+            if part.filename:
+                handles[part.name], _ = await stage_upload_part(part)
+            elif part.name == "payload":
+                json_data = json.loads(await part.text())
+    except Exception:
+        # Parts staged before the failing one are never referenced by a prompt
+        for handle in handles.values():
+            try:
+                os.remove(os.path.join(UPLOAD_DIR, handle[len(UPLOAD_SCHEME):]))
+            except OSError:
+                pass
+        raise
+
+    def replace_handles(value):
+        if isinstance(value, str):
+            return re.sub(
+                re.escape(UPLOAD_SCHEME) + r"([\w.-]+)",
+                lambda match: handles.get(match.group(1), match.group(0)),
+                value
+            )
+        if isinstance(value, dict):
+            return {k: replace_handles(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [replace_handles(v) for v in value]
+        return value
+
+    if handles and json_data.get("prompt"):
+        json_data["prompt"] = replace_handles(json_data["prompt"])
+    return json_data
+
+
+async def execute_prompt(prompt: dict, client_id: str = None, pre_prompt_id: str = None,
+                         randomize_seed: bool = True, tenant: str = None, priority: int = 0,
+                         front: bool = False, deadline: float = None, interrupt_expired: bool = False) -> str:
     """
     Execute ComfyUI workflow task
 
@@ -755,24 +1580,45 @@ async def execute_prompt(prompt: dict, client_id: str = None, pre_prompt_id: str
         prompt: ComfyUI workflow JSON
         client_id: optional client ID
         pre_prompt_id: optional preset prompt_id, if provided, use this ID instead of generating a new one
+        randomize_seed: apply random seeds, disabled when the seed policy of the request already applied them
+        tenant: optional tenant the prompt is accounted to for fair sharing
+        priority: higher priorities run earlier, each level moves PRIORITY_STEP positions ahead
+        front: insert at the front of the waiting queue
+        deadline: optional unix time after which the task expires
+        interrupt_expired: interrupt the task if it is still running at its deadline
 
     Returns:
         Task ID
     """
-    prompt_server = server.PromptServer.instance
-
     prompt_id = pre_prompt_id or str(uuid.uuid4())
 
     if not client_id:
         client_id = f"comfy-deploy-client-{prompt_id[:8]}"
         logger.info(f"[comfy-deploy] No client_id provided, generate new: {client_id}")
 
+    outputs_to_execute = await validate_task_prompt(prompt, prompt_id, randomize_seed)
+    if outputs_to_execute is None:
+        return None
+
+    enqueue_prompt(prompt, prompt_id, client_id, outputs_to_execute, tenant, priority, front,
+                   deadline, interrupt_expired)
+    return prompt_id
+
+
+async def validate_task_prompt(prompt: dict, prompt_id: str, randomize_seed: bool = True) -> Optional[list]:
+    """
+    Apply random seeds if enabled and validate a workflow
+
+    Returns:
+        Output nodes to execute, None if the validation failed
+    """
     partial_execution_targets = None
     if "partial_execution_targets" in prompt:
         partial_execution_targets = prompt["partial_execution_targets"]
 
     # Apply random seed
-    apply_random_seed_to_workflow(prompt)
+    if randomize_seed:
+        apply_random_seed_to_workflow(prompt)
 
     # Validate task
     valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
@@ -781,6 +1627,26 @@ async def execute_prompt(prompt: dict, client_id: str = None, pre_prompt_id: str
         logger.error(f"[comfy-deploy] Task validation failed: {valid[1]}")
         return None
 
+    # Get output nodes
+    return valid[2]
+
+
+def enqueue_prompt(prompt: dict, prompt_id: str, client_id: str, outputs_to_execute: list, tenant: str = None,
+                   priority: int = 0, front: bool = False, deadline: float = None,
+                   interrupt_expired: bool = False) -> None:
+    """
+    Put a validated workflow into the ComfyUI queue as an API task
+
+    Parameters:
+        prompt: validated ComfyUI workflow JSON
+        prompt_id: task ID
+        client_id: client ID
+        outputs_to_execute: output nodes returned by the validation
+        tenant, priority, front: queue options, see get_queue_number
+        deadline, interrupt_expired: optional deadline of the task, see execute_prompt
+    """
+    prompt_server = server.PromptServer.instance
+
     extra_data = {
         "client_id": client_id,
         "prompt_id": prompt_id
@@ -789,26 +1655,298 @@ async def execute_prompt(prompt: dict, client_id: str = None, pre_prompt_id: str
     sensitive_data = {}
     # logger.info(f"[comfy-deploy] Set client_id for task {prompt_id}: {client_id}")
 
-    # Get output nodes
-    outputs_to_execute = valid[2]
-
-    # Submit task to queue
-    number = prompt_server.number
-    prompt_server.number += 1
-
-    prompt_server.prompt_queue.put(
-        (number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive_data)
-    )
-
+    # Registered before the put, the worker may finish the task before put returns
     # Mark task as API created task
     task_manager.api_created_tasks.add(prompt_id)
+    task_manager.add_in_flight(prompt_id, client_id)
+    task_manager.task_priorities[prompt_id] = None if front else priority
+    if deadline is not None:
+        task_manager.set_deadline(prompt_id, deadline, interrupt_expired)
 
     # Save client_id and prompt_id mapping
     task_manager.client_prompts[client_id] = prompt_id
     task_manager.prompts_client[prompt_id] = client_id
     # logger.info(f"[comfy-deploy] Save client_id mapping: {client_id} -> {prompt_id}")
 
-    return prompt_id
+    # Submit task to queue, the queue is locked from reading its head for the number until the put
+    try:
+        with prompt_server.prompt_queue.mutex:
+            number = get_queue_number(tenant, priority, front)
+            prompt_server.prompt_queue.put(
+                (number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive_data)
+            )
+    except Exception:
+        task_manager.cleanup_task(prompt_id, client_id)
+        raise
+
+    # Download input images while the task waits in the queue
+    prefetch_prompt_images(prompt)
+
+
+def get_sweep_value_input(class_type: str) -> Optional[str]:
+    """Input of an External node that receives the request value, None for other nodes"""
+    if class_type == "ComfyDeployExternalImage":
+        return "param_name"
+    if class_type and class_type.startswith("ComfyDeployExternal") and class_type != "ComfyDeployExternalOutput":
+        return "default_value"
+    return None
+
+
+def get_downstream_nodes(prompt: dict, node_ids: set) -> set:
+    """Nodes of a prompt that depend on any of the given nodes, including the nodes themselves"""
+    consumers = defaultdict(set)
+    for node_id, node_data in prompt.items():
+        for value in (node_data.get("inputs") or {}).values():
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) in prompt:
+                consumers[str(value[0])].add(node_id)
+
+    affected = set(node_ids)
+    pending = list(node_ids)
+    while pending:
+        for consumer in consumers[pending.pop()]:
+            if consumer not in affected:
+                affected.add(consumer)
+                pending.append(consumer)
+    return affected
+
+
+def expand_sweep(prompt: dict, sweep: dict) -> list:
+    """
+    Expand a sweep ({param_name: [values]}) into the cartesian product of prompts
+
+    ComfyUI reuses the cached outputs of nodes whose inputs did not change since the previous prompt.
+    Parameters affecting the most nodes vary slowest, so consecutive prompts differ only in the parameters
+    closest to the outputs and share as much of the upstream graph as possible
+
+    Returns:
+        List of (params, prompt) in execution order
+
+    Raises:
+        ValueError: if a parameter has no External node or the product exceeds SWEEP_MAX_PROMPTS
+    """
+    param_nodes = defaultdict(list)  # param_name -> [(node_id, value input)]
+    for node_id, node_data in prompt.items():
+        value_input = get_sweep_value_input(node_data.get("class_type"))
+        if value_input is None:
+            continue
+        param_name = (node_data.get("inputs") or {}).get("param_name")
+        param_nodes[param_name].append((node_id, value_input))
+
+    for param_name, values in sweep.items():
+        if param_name not in param_nodes:
+            raise ValueError(f"Sweep parameter {param_name} has no External node")
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Sweep parameter {param_name} must be a non-empty list")
+
+    total = 1
+    for values in sweep.values():
+        total *= len(values)
+    if total > config.SWEEP_MAX_PROMPTS:
+        raise ValueError(f"Sweep expands to {total} prompts, maximum is {config.SWEEP_MAX_PROMPTS}")
+
+    affected = {
+        param_name: len(get_downstream_nodes(prompt, {node_id for node_id, _ in param_nodes[param_name]}))
+        for param_name in sweep
+    }
+    # itertools.product varies the last parameter fastest
+    ordered_params = sorted(sweep, key=lambda name: (-affected[name], name))
+
+    expansions = []
+    for values in itertools.product(*(sweep[name] for name in ordered_params)):
+        params = dict(zip(ordered_params, values))
+        expanded = json.loads(json.dumps(prompt))
+        for param_name, value in params.items():
+            for node_id, value_input in param_nodes[param_name]:
+                expanded[node_id]["inputs"][value_input] = value
+        expansions.append((params, expanded))
+    return expansions
+
+
+async def submit_sweep(prompt: dict, sweep: dict, client_id: str, sweep_id: str = None,
+                       callback_url: str = None, **queue_options) -> dict:
+    """
+    Queue every prompt of a sweep back to back, results are sent in one sweep_completed callback
+
+    Parameters:
+        prompt: ComfyUI workflow JSON
+        sweep: {param_name: [values]}
+        client_id: client ID shared by the sweep members
+        sweep_id: optional preset sweep ID
+        callback_url: optional callback URL of the aggregated result
+        queue_options: tenant, priority, front, deadline and interrupt_expired of the member prompts
+
+    Returns:
+        Submit response with the sweep ID and its member tasks
+    """
+    sweep_id = sweep_id or str(uuid.uuid4())
+    # Seeds were applied once by the seed policy, identical upstream nodes keep identical inputs across the sweep
+    expansions = expand_sweep(prompt, sweep)
+
+    # Every member is validated before the first one is queued, an invalid member rejects the whole sweep
+    tasks = []
+    members = []
+    for params, expanded in expansions:
+        prompt_id = str(uuid.uuid4())
+        outputs_to_execute = await validate_task_prompt(expanded, prompt_id, randomize_seed=False)
+        if outputs_to_execute is None:
+            raise ValueError(f"Task validation failed for sweep parameters {params}")
+        tasks.append({"prompt_id": prompt_id, "params": params})
+        members.append((prompt_id, expanded, outputs_to_execute))
+
+    # Registered before the first put, a cached member may finish before the next one is queued
+    if callback_url:
+        task_manager.callback_urls[sweep_id] = callback_url
+    task_manager.add_sweep(sweep_id, client_id, tasks)
+    if client_id in ws_manager.machine_listeners or client_id in ws_manager.machine_prompts:
+        ws_manager.machine_prompts[client_id].update(task["prompt_id"] for task in tasks)
+
+    queued = []
+    try:
+        for prompt_id, expanded, outputs_to_execute in members:
+            enqueue_prompt(expanded, prompt_id, client_id, outputs_to_execute, **queue_options)
+            queued.append(prompt_id)
+    except Exception:
+        task_manager.discard_sweep(sweep_id)
+        for prompt_id in queued:
+            cancel_task(prompt_id, message="Sweep submission failed")
+        raise
+
+    logger.info(f"[comfy-deploy] Sweep {sweep_id} queued {len(tasks)} tasks, order: {list(tasks[0]['params'])}")
+
+    return {"sweep_id": sweep_id, "client_id": client_id, "status": "submitted", "tasks": tasks}
+
+
+async def handle_sweep_result(prompt_id: str, result: dict) -> None:
+    """Record a finished sweep member, send the aggregated result once every member finished"""
+    sweep_id = task_manager.record_sweep_result(prompt_id, result)
+    task_manager.cleanup_task(prompt_id, None)
+    if sweep_id is None:
+        return
+
+    sweep = task_manager.sweeps.pop(sweep_id)
+    items = [{**task, **sweep["results"][task["prompt_id"]]} for task in sweep["tasks"]]
+    failed = sum(1 for item in items if item["status"] != "success")
+    sweep_data = {
+        "sweep_id": sweep_id,
+        "client_id": sweep["client_id"],
+        "status": "success" if not failed else "partial" if failed < len(items) else "failed",
+        "total": len(items),
+        "failed": failed,
+        "tasks": items,
+        "timestamp": int(time.time())
+    }
+    logger.info(f"[comfy-deploy] Sweep {sweep_id} finished, {len(items) - failed}/{len(items)} tasks succeeded")
+
+    await send_task_update(sweep_id, "sweep_completed", sweep_data)
+    if sweep_id in task_manager.callback_urls:
+        await send_callback(sweep_id, "sweep_completed", sweep_data)
+        task_manager.callback_urls.pop(sweep_id, None)
+
+
+def cancel_task(prompt_id: str, event_name: str = "task_cancelled", interrupt: bool = True,
+                message: str = "Task cancelled") -> Optional[str]:
+    """
+    Remove an API task from the waiting queue, or interrupt it if it is running, and release its state
+
+    Parameters:
+        prompt_id: task ID
+        event_name: callback and WebSocket event sent for the task
+        interrupt: interrupt the task if it is already running
+        message: message of the event
+
+    Returns:
+        "removed" or "interrupted", None if the task is not an API task, is neither waiting nor running
+        (or running and interrupt is False)
+    """
+    # Prompts of the ComfyUI web UI are never touched
+    if prompt_id not in task_manager.api_created_tasks:
+        return None
+    prompt_queue = server.PromptServer.instance.prompt_queue
+    if prompt_queue.delete_queue_item(lambda item: item[1] == prompt_id):
+        outcome = "removed"
+    else:
+        # Held across the check and the interrupt, the task cannot be replaced by the next prompt in between
+        with prompt_queue.mutex:
+            running = is_task_running(prompt_id)
+            if not running or not interrupt:
+                return None
+            # ComfyUI interrupts the prompt that is executing, which is this task while the mutex is held
+            comfy.model_management.interrupt_current_processing()
+            if prompt_id not in task_manager.task_clients:
+                # Already sent its terminal event, the interrupt flag is reset when the next prompt starts
+                logger.info(f"[comfy-deploy] Task {prompt_id} finished before it could be interrupted")
+                return None
+        outcome = "interrupted"
+
+    client_id = task_manager.prompts_client.get(prompt_id)
+    logger.info(f"[comfy-deploy] Task {prompt_id} {outcome}: {message}")
+    task_manager.release_in_flight(prompt_id)
+    task_manager.release_prompt_hash(prompt_id)
+
+    event_data = {
+        "prompt_id": prompt_id,
+        "client_id": client_id,
+        "status": event_name[len("task_"):],
+        "progress": 0,
+        "message": message,
+        "timestamp": int(time.time())
+    }
+    # WebSocket first, the state is released after the callback (or right away without one)
+    ws_manager.ws_event_queue.put((prompt_id, event_name, event_data))
+    if task_manager.get_callback_urls(prompt_id):
+        ws_manager.ws_event_queue.put((prompt_id, "callback", (event_name, event_data)))
+    else:
+        ws_manager.ws_event_queue.put((prompt_id, "task_cleanup", client_id))
+
+    if prompt_id in task_manager.prompt_sweeps:
+        ws_manager.ws_event_queue.put((prompt_id, "sweep_result", {"status": event_name[len("task_"):]}))
+    return outcome
+
+
+def detach_task_caller(prompt_id: str, caller: str) -> bool:
+    """
+    Detach one caller from a task that identical submissions attached to, instead of cancelling it for all
+
+    Parameters:
+        prompt_id: task ID
+        caller: task_id of an attached duplicate, or client_id of the submitter or of an attached duplicate
+
+    Returns:
+        True if the caller was detached and the task keeps running for the other callers
+    """
+    attached = task_manager.attached_callers.get(prompt_id)
+    if not attached or not caller:
+        return False
+    callers = [key for key, (client_id, _) in attached.items() if caller in (key, client_id)]
+    submitter = task_manager.prompts_client.get(prompt_id)
+    if callers:
+        for key in callers:
+            client_id, _ = attached.pop(key)
+            if task_manager.task_aliases.get(key) == prompt_id:
+                del task_manager.task_aliases[key]
+            if client_id != submitter and client_id in ws_manager.machine_prompts:
+                ws_manager.machine_prompts[client_id].discard(prompt_id)
+    elif caller == submitter:
+        # The submitter leaves, the first attached caller takes the task over
+        client_id, callback_url = attached.pop(next(iter(attached)))
+        if callback_url:
+            task_manager.callback_urls[prompt_id] = callback_url
+        else:
+            task_manager.callback_urls.pop(prompt_id, None)
+        task_manager.release_in_flight(prompt_id)
+        task_manager.add_in_flight(prompt_id, client_id)
+        task_manager.prompts_client[prompt_id] = client_id
+        if task_manager.client_prompts.get(submitter) == prompt_id:
+            del task_manager.client_prompts[submitter]
+        task_manager.client_prompts[client_id] = prompt_id
+        if submitter in ws_manager.machine_prompts:
+            ws_manager.machine_prompts[submitter].discard(prompt_id)
+    else:
+        return False
+    if not attached:
+        del task_manager.attached_callers[prompt_id]
+    logger.info(f"[comfy-deploy] Caller {caller} detached from task {prompt_id}, {len(attached)} still attached")
+    return True
 
 
 def get_task_details(prompt_id: str) -> dict:
@@ -889,7 +2027,15 @@ def get_prompt_history() -> dict:
 async def api_execute_prompt(request):
     """API endpoints for submitting task execution"""
     try:
-        json_data = await request.json()
+        try:
+            if request.content_type == "multipart/form-data":
+                json_data = await read_multipart_execute_request(request)
+            else:
+                json_data = await request.json()
+        except json.JSONDecodeError as e:
+            return web.json_response({"error": f"Invalid JSON payload: {str(e)}"}, status=400)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=413)
         prompt = json_data.get("prompt")
         callback_url = json_data.get("callback_url")
 
@@ -900,13 +2046,94 @@ async def api_execute_prompt(request):
         if not prompt:
             return web.json_response({"error": "No workflow data provided"}, status=400)
 
-        if callback_url:
-            task_manager.callback_urls[pre_prompt_id] = callback_url
-            logger.info(f"[comfy-deploy] Set callback URL for task {pre_prompt_id}: {callback_url}")
+        try:
+            queue_options = {
+                "tenant": str(json_data["tenant"]) if json_data.get("tenant") else None,
+                "priority": int(json_data.get("priority") or 0),
+            }
+        except (TypeError, ValueError):
+            return web.json_response({"error": "priority must be an integer"}, status=400)
+        try:
+            queue_options["front"] = get_request_bool(json_data, "front", False)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
 
-        prompt_id = await execute_prompt(prompt, client_id=client_id, pre_prompt_id=pre_prompt_id)
+        # Retried submissions with a known task_id are answered instead of queued again
+        if pre_prompt_id and is_known_task(pre_prompt_id):
+            logger.info(f"[comfy-deploy] Task {pre_prompt_id} already submitted, skip duplicate submission")
+            prompt_id = task_manager.task_aliases.get(pre_prompt_id, pre_prompt_id)
+            return web.json_response({"prompt_id": prompt_id, "client_id": client_id, "status": "exists"})
 
-        if not prompt_id:
+        try:
+            deadline = get_request_deadline(json_data)
+        except (TypeError, ValueError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        try:
+            interrupt_expired = get_request_bool(json_data, "interrupt_expired", config.DEADLINE_INTERRUPT_RUNNING)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        # random: new seeds for every submission, fixed: keep the seeds of the workflow
+        seed_policy = json_data.get("seed_policy", "random")
+        if seed_policy not in ("random", "fixed"):
+            return web.json_response({"error": "seed_policy must be random or fixed"}, status=400)
+        if seed_policy == "random":
+            apply_random_seed_to_workflow(prompt)
+
+        sweep = json_data.get("sweep")
+        if sweep:
+            if not isinstance(sweep, dict):
+                return web.json_response({"error": "sweep must be an object of value lists"}, status=400)
+            rejection = check_admission(client_id, math.prod(
+                len(values) if isinstance(values, list) else 1 for values in sweep.values()
+            ))
+            if rejection is not None:
+                return rejection
+            # Reserved until the sweep is registered, a concurrent retry is answered as a known task
+            if pre_prompt_id:
+                task_manager.pending_tasks.add(pre_prompt_id)
+            try:
+                response = await submit_sweep(prompt, sweep, client_id, sweep_id=pre_prompt_id,
+                                              callback_url=callback_url, deadline=deadline,
+                                              interrupt_expired=interrupt_expired, **queue_options)
+            except ValueError as e:
+                return web.json_response({"error": str(e)}, status=400)
+            finally:
+                task_manager.pending_tasks.discard(pre_prompt_id)
+            return web.json_response(response)
+
+        prompt_hash = get_prompt_hash(prompt) if config.DEDUPE_ENABLED else None
+        if prompt_hash:
+            duplicate_response = attach_duplicate_prompt(prompt_hash, client_id, callback_url, pre_prompt_id)
+            if duplicate_response is not None:
+                return duplicate_response
+
+        rejection = check_admission(client_id)
+        if rejection is not None:
+            return rejection
+
+        # The task ID and prompt hash are reserved before validation yields to the event loop, so a
+        # concurrent retry or identical submission finds them instead of being queued a second time
+        prompt_id = pre_prompt_id or str(uuid.uuid4())
+        task_manager.pending_tasks.add(prompt_id)
+        if prompt_hash:
+            task_manager.track_prompt_hash(prompt_hash, prompt_id)
+
+        if callback_url:
+            task_manager.callback_urls[prompt_id] = callback_url
+            logger.info(f"[comfy-deploy] Set callback URL for task {prompt_id}: {callback_url}")
+
+        try:
+            queued = await execute_prompt(prompt, client_id=client_id, pre_prompt_id=prompt_id,
+                                          randomize_seed=False, deadline=deadline,
+                                          interrupt_expired=interrupt_expired, **queue_options)
+        except Exception:
+            release_rejected_submission(prompt_id, "Task submission failed")
+            raise
+        task_manager.pending_tasks.discard(prompt_id)
+
+        if not queued:
+            release_rejected_submission(prompt_id, "Task validation failed")
             return web.json_response({"error": "Task validation failed"}, status=400)
 
         # If client_id is machine ID, add task to machine associated task set
@@ -956,6 +2183,115 @@ async def api_execute_prompt(request):
         return web.json_response({"error": str(e)}, status=500)
 
 
+@server.PromptServer.instance.routes.post("/api/v1/upload")
+async def api_upload_inputs(request):
+    """API endpoints for staging raw input files, returns upload:// handles for the External Image nodes"""
+    try:
+        if request.content_type != "multipart/form-data":
+            return web.json_response({"error": "multipart/form-data body required"}, status=400)
+
+        uploads = []
+        reader = await request.multipart()
+        while (part := await reader.next()) is not None:
+            if not part.filename:
+                continue
+            handle, size = await stage_upload_part(part)
+            uploads.append({"field": part.name, "filename": part.filename, "handle": handle, "size": size})
+
+        if not uploads:
+            return web.json_response({"error": "No file provided"}, status=400)
+
+        return web.json_response({"uploads": uploads})
+
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=413)
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Upload input failed: {str(e)}")
+        import traceback
+        logger.error(f"Error details: {traceback.format_exc()}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
+@server.PromptServer.instance.routes.delete("/api/v1/task/{prompt_id}")
+async def api_cancel_task(request):
+    """
+    API endpoints for cancelling a queued or running API task, or the pending members of a sweep
+
+    A task shared with identical submissions is only cancelled by its last caller, the others are detached.
+    The caller is identified by its own task_id in the path or by ?client_id=
+    """
+    try:
+        task_id = request.match_info.get("prompt_id", "")
+        if not task_id:
+            return web.json_response({"error": "No task ID provided"}, status=400)
+
+        # A duplicate cancelling by its own task_id is identified by it
+        prompt_id = task_manager.task_aliases.get(task_id, task_id)
+        caller = task_id if prompt_id != task_id else request.query.get("client_id")
+
+        sweep = task_manager.sweeps.get(prompt_id)
+        if sweep is not None:
+            cancelled = []
+            for task in sweep["tasks"]:
+                if task["prompt_id"] not in sweep["results"]:
+                    outcome = cancel_task(task["prompt_id"])
+                    if outcome is not None:
+                        cancelled.append({"prompt_id": task["prompt_id"], "action": outcome})
+            return web.json_response({"sweep_id": prompt_id, "status": "cancelled", "cancelled": cancelled})
+
+        if prompt_id not in task_manager.api_created_tasks:
+            return web.json_response({"error": "Task not found or already finished"}, status=404)
+
+        if task_manager.attached_callers.get(prompt_id):
+            if detach_task_caller(prompt_id, caller):
+                return web.json_response({"prompt_id": prompt_id, "status": "detached", "action": "detached"})
+            return web.json_response({
+                "error": "Task is shared with identical submissions, cancel it by your own task_id or pass "
+                         "your client_id"
+            }, status=409)
+
+        outcome = cancel_task(prompt_id)
+        if outcome is None:
+            return web.json_response({"error": "Task not found or already finished"}, status=404)
+
+        return web.json_response({"prompt_id": prompt_id, "status": "cancelled", "action": outcome})
+
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Cancel task failed: {str(e)}")
+        import traceback
+        logger.error(f"Error details: {traceback.format_exc()}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
+@server.PromptServer.instance.routes.delete("/api/v1/tasks")
+async def api_cancel_client_tasks(request):
+    """API endpoints for cancelling every queued or running task of a client (?client_id=)"""
+    try:
+        client_id = request.query.get("client_id")
+        if not client_id:
+            return web.json_response({"error": "No client_id provided"}, status=400)
+
+        cancelled = []
+        for prompt_id in list(task_manager.client_tasks.get(client_id, ())):
+            # Tasks shared with identical submissions of other callers keep running for them
+            outcome = "detached" if detach_task_caller(prompt_id, client_id) else cancel_task(prompt_id)
+            if outcome is not None:
+                cancelled.append({"prompt_id": prompt_id, "action": outcome})
+        # Tasks of other clients the client attached to with identical submissions
+        for prompt_id, callers in list(task_manager.attached_callers.items()):
+            if any(caller_client == client_id for caller_client, _ in callers.values()):
+                if detach_task_caller(prompt_id, client_id):
+                    cancelled.append({"prompt_id": prompt_id, "action": "detached"})
+
+        return web.json_response({"client_id": client_id, "cancelled": cancelled})
+
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Cancel client tasks failed: {str(e)}")
+        import traceback
+        logger.error(f"Error details: {traceback.format_exc()}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
 @server.PromptServer.instance.routes.get("/api/v1/status/{prompt_id}")
 async def api_get_prompt_status(request):
     """API endpoints for querying task status"""
@@ -1013,6 +2349,121 @@ async def api_get_output(request):
         return web.json_response({"error": str(e)}, status=500)
 
 
+@server.PromptServer.instance.routes.get("/api/v1/output/{prompt_id}/{node_id}/file/{index}")
+async def api_get_output_file(request):
+    """API endpoints for streaming a task output file, supports Range and ETag/If-None-Match"""
+    try:
+        prompt_id = request.match_info.get("prompt_id", "")
+        node_id = request.match_info.get("node_id", "")
+
+        try:
+            index = int(request.match_info.get("index", "0"))
+        except ValueError:
+            return web.json_response({"error": "Invalid output index"}, status=400)
+
+        items = get_task_output_items(prompt_id, node_id)
+        if items is None:
+            return web.json_response({"error": "Task not found"}, status=404)
+
+        if index < 0 or index >= len(items):
+            return web.json_response({"error": "Node output not found"}, status=404)
+
+        item = items[index]
+        source = resolve_output_source(item)
+        if source is None:
+            return web.json_response({"error": "Output file not found"}, status=404)
+
+        filename = os.path.basename(item["filename"])
+        if isinstance(source, bytes):
+            return memory_output_response(request, source, item.get("key", ""), filename)
+
+        # FileResponse streams with sendfile and answers Range / If-None-Match / If-Modified-Since itself
+        return web.FileResponse(source, headers={
+            "Cache-Control": f"private, max-age={config.OUTPUT_FILE_CACHE_MAX_AGE}",
+            "Content-Type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            "Content-Disposition": content_disposition("inline", filename)
+        })
+
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Get task output file failed: {str(e)}")
+        import traceback
+        logger.error(f"Error details: {traceback.format_exc()}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
+@server.PromptServer.instance.routes.get("/api/v1/archive/{prompt_id}")
+async def api_get_output_archive(request):
+    """API endpoints for downloading all output files of a task as one streamed zip"""
+    prompt_id = request.match_info.get("prompt_id", "")
+    node_id = request.query.get("node_id")
+
+    items = get_task_output_items(prompt_id, node_id)
+    if items is None:
+        return web.json_response({"error": "Task not found"}, status=404)
+
+    files = []
+    arcnames = set()
+    for item in items:
+        source = resolve_output_source(item)
+        if source is None:
+            continue
+        arcname = f"{item.get('node_id', node_id)}/{os.path.basename(item['filename'])}"
+        if arcname in arcnames:
+            continue
+        arcnames.add(arcname)
+        files.append((source, arcname))
+
+    if not files:
+        return web.json_response({"error": "Output file not found"}, status=404)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "application/zip",
+        "Content-Disposition": content_disposition("attachment", f"{prompt_id}.zip")
+    })
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    loop = asyncio.get_running_loop()
+    writer = ZipStreamWriter(response, loop, config.OUTPUT_ARCHIVE_CHUNK_SIZE)
+    try:
+        await loop.run_in_executor(None, write_zip_archive, writer, files)
+    except Exception as e:
+        # Headers are already sent, the client sees a truncated archive
+        logger.error(f"[comfy-deploy] Stream task {prompt_id} output archive failed: {str(e)}")
+        return response
+
+    await response.write_eof()
+    return response
+
+
+@server.PromptServer.instance.routes.get("/api/v1/blob/{key}")
+async def api_get_output_blob(request):
+    """API endpoints for getting an output held in the in-memory output store"""
+    key = request.match_info.get("key", "")
+    stored = output_store.get(key)
+    if stored is None:
+        return web.json_response({"error": "Output not found"}, status=404)
+
+    data, path, media_type = stored
+    if data is None:
+        return web.FileResponse(path, headers={
+            "Cache-Control": f"private, max-age={config.OUTPUT_FILE_CACHE_MAX_AGE}",
+            "Content-Type": media_type
+        })
+    return memory_output_response(request, data, key, content_type=media_type)
+
+
+@server.PromptServer.instance.routes.get("/api/v1/cache/stats")
+async def api_get_cache_stats(_):
+    """API endpoints for getting input cache statistics"""
+    return web.json_response({
+        "image_cache": image_cache.get_stats(),
+        "tensor_cache": tensor_cache.get_stats(),
+        "download_hosts": host_health.get_stats(),
+        "timestamp": int(time.time())
+    })
+
+
 @server.PromptServer.instance.routes.get("/comfy-deploy/status")
 async def get_comfy_deploy_status(_):
     """Health check endpoint"""
@@ -1055,6 +2506,11 @@ async def machine_websocket_handler(request):
             if client_id == machine_id:
                 active_tasks.append(prompt_id)
                 ws_manager.machine_prompts[machine_id].add(prompt_id)
+        # Tasks the machine attached to with identical submissions
+        for prompt_id, callers in task_manager.attached_callers.items():
+            if any(client_id == machine_id for client_id, _ in callers.values()):
+                active_tasks.append(prompt_id)
+                ws_manager.machine_prompts[machine_id].add(prompt_id)
 
         # if active_tasks:
         #     logger.info(f"[comfy-deploy] Machine {machine_id} has {len(active_tasks)} associated tasks")
@@ -1124,29 +2580,9 @@ async def send_task_update(prompt_id, event_name, data):
         enhanced_data["progress"] = 100
         enhanced_data["completed"] = True
 
-        try:
-            prompt_server = server.PromptServer.instance
-            history = prompt_server.prompt_queue.get_history(prompt_id)
-            if history and prompt_id in history:
-                history_data = history[prompt_id]
-                outputs = history_data.get('outputs', {})
-
-                # Extract output results
-                result = {'images': [], 'videos': [], '3d': []}
-                for output in outputs.values():
-                    if output:
-                        for k, v in output.items():
-                            if 'images' in k or 'gifs' in k:
-                                result['images'].extend(v)
-                            elif 'videos' in k:
-                                result['videos'].extend(v)
-                            elif '3d' in k:
-                                result['3d'].extend(v)
-
-                enhanced_data["result"] = result
-                enhanced_data["raw_outputs"] = outputs
-        except Exception as e:
-            logger.error(f"Error getting task {prompt_id} results: {str(e)}")
+        # result and raw_outputs are attached from the output index when the event is queued
+        enhanced_data.setdefault("result", new_result_index())
+        enhanced_data.setdefault("raw_outputs", {})
 
     if event_name in ["execution_error"]:
         enhanced_data["status"] = "failed"
@@ -1288,6 +2724,39 @@ async def send_machine_task_update(machine_id, prompt_id, event_name, data=None)
 async def start_ws_queue_processor(_):
     """Start WebSocket event queue processor when server starts"""
     asyncio.create_task(process_ws_event_queue())
+    asyncio.create_task(process_task_deadlines())
+    asyncio.create_task(process_stale_tasks())
+
+
+async def process_task_deadlines():
+    """Async task: expire tasks whose deadline passed, sleeps until the nearest deadline"""
+    while True:
+        try:
+            now = time.time()
+            for prompt_id, interrupt in task_manager.pop_expired(now):
+                outcome = cancel_task(prompt_id, "task_expired", interrupt=interrupt,
+                                      message="Task deadline passed")
+                if outcome is None and not interrupt and is_task_running(prompt_id):
+                    logger.info(f"[comfy-deploy] Task {prompt_id} deadline passed while running, let it finish")
+
+            next_deadline = task_manager.deadline_heap[0][0] if task_manager.deadline_heap else None
+            delay = config.DEADLINE_CHECK_INTERVAL
+            if next_deadline is not None:
+                delay = min(delay, max(0.0, next_deadline - time.time()))
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.error(f"[comfy-deploy] Error processing task deadlines: {str(e)}")
+            await asyncio.sleep(1)
+
+
+async def process_stale_tasks():
+    """Async task: release API tasks that left the ComfyUI queue without a terminal event"""
+    while True:
+        await asyncio.sleep(config.STALE_TASK_CHECK_INTERVAL)
+        try:
+            reconcile_in_flight()
+        except Exception as e:
+            logger.error(f"[comfy-deploy] Error reconciling in-flight tasks: {str(e)}")
 
 
 async def process_ws_event_queue():
@@ -1302,6 +2771,14 @@ async def process_ws_event_queue():
                     # Process callback notification
                     callback_event_name, callback_data = data
                     await send_callback(prompt_id, callback_event_name, callback_data)
+                elif event_type == "task_cleanup":
+                    task_manager.cleanup_task(prompt_id, data)
+                elif event_type == "sweep_result":
+                    await handle_sweep_result(prompt_id, data)
+                elif event_type == "finalize_outputs":
+                    # Run output post-processing without blocking other events
+                    result, events = data
+                    asyncio.create_task(finalize_task_outputs(prompt_id, result, events))
                 else:
                     # Process WebSocket notification (for comfy-deploy-admin web UI)
                     await send_task_update(prompt_id, event_type, data)
@@ -1313,16 +2790,46 @@ async def process_ws_event_queue():
             await asyncio.sleep(1)
 
 
+async def finalize_task_outputs(prompt_id: str, result: dict, events: list) -> None:
+    """
+    Post-process task outputs between execution_success and task_success, then queue the success events
+
+    Parameters:
+        prompt_id: task ID
+        result: result index shared by the queued events, updated in place
+        events: success events (callback and WebSocket) to queue when finished
+    """
+    try:
+        if config.THUMBNAIL_ENABLED:
+            await create_task_thumbnails(prompt_id, result)
+        if config.S3_UPLOAD_ENABLED:
+            await upload_task_outputs(prompt_id, result)
+    except Exception as e:
+        logger.error(f"[comfy-deploy] Error post-processing outputs of task {prompt_id}: {str(e)}")
+    finally:
+        for event in events:
+            ws_manager.ws_event_queue.put(event)
+
+
 async def send_callback(prompt_id, event_name, data):
     if not check_event_handling():
         return
 
-    if prompt_id not in task_manager.callback_urls:
+    # Duplicates attached to the task receive the same callbacks
+    callback_urls = task_manager.get_callback_urls(prompt_id)
+
+    if not callback_urls:
         logger.warning(f"[comfy-deploy] Task {prompt_id} has no callback URL configured")
         return
 
-    callback_url = task_manager.callback_urls[prompt_id]
+    for callback_url in callback_urls:
+        await post_callback(callback_url, event_name, data)
+
+    if event_name in ["task_success", "task_failed", "task_cancelled", "task_expired"]:
+        task_manager.cleanup_task(prompt_id, data.get('client_id'))
+
 
+async def post_callback(callback_url, event_name, data):
     try:
         callback_data = {
             "event": event_name,
@@ -1346,8 +2853,151 @@ async def send_callback(prompt_id, event_name, data):
     except Exception as e:
         logger.error(f"[comfy-deploy] Error sending {event_name} event: {str(e)}")
 
-    if event_name in ["task_success", "task_failed"]:
-        task_manager.cleanup_task(prompt_id, data.get('client_id'))
+
+# ========================= Output thumbnails =========================
+thumbnail_executor = None
+
+
+def get_thumbnail_executor() -> ThreadPoolExecutor:
+    global thumbnail_executor
+    if thumbnail_executor is None:
+        # Threads, not processes: forking the CUDA process is unsafe and PIL releases the GIL while resizing
+        # and encoding
+        thumbnail_executor = ThreadPoolExecutor(max_workers=config.THUMBNAIL_WORKERS,
+                                                thread_name_prefix="comfy-deploy-thumbnail")
+    return thumbnail_executor
+
+
+async def create_task_thumbnails(prompt_id: str, result: dict) -> None:
+    """
+    Create thumbnails of all image outputs in the thumbnail thread pool and put them into result.images[*].thumbnail
+
+    Parameters:
+        prompt_id: task ID
+        result: result index, image items are replaced by copies with an added `thumbnail`
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_thumbnail_executor()
+    start_time = time.time()
+
+    async def thumbnail_item(index: int, item: dict) -> None:
+        source = resolve_output_source(item)
+        if source is None:
+            return
+        try:
+            data, width, height = await loop.run_in_executor(
+                executor, make_thumbnail, source, config.THUMBNAIL_MAX_SIDE, config.THUMBNAIL_QUALITY
+            )
+        except Exception as e:
+            logger.error(f"[comfy-deploy] Create thumbnail of {item.get('filename')} of task {prompt_id} failed: {str(e)}")
+            return
+
+        if len(data) <= config.THUMBNAIL_INLINE_MAX_BYTES:
+            url = f"data:image/webp;base64,{base64.b64encode(data).decode()}"
+        else:
+            url = f"/api/v1/blob/{output_store.put(data, 'image/webp')}"
+        # Copy the item, the original dict is shared with ComfyUI history
+        result["images"][index] = {**item, "thumbnail": {"url": url, "width": width, "height": height}}
+
+    items = list(enumerate(result.get("images", [])))
+    await asyncio.gather(*(thumbnail_item(index, item) for index, item in items))
+    logger.info(f"[comfy-deploy] Created {len(items)} thumbnails of task {prompt_id} in {time.time() - start_time:.2f}s")
+
+
+# ========================= Output upload =========================
+s3_client = None
+s3_executor = None
+
+
+def get_s3_client():
+    global s3_client, s3_executor
+    if s3_client is None:
+        s3_client = boto3.client(
+            "s3",
+            endpoint_url=config.S3_ENDPOINT_URL,
+            region_name=config.S3_REGION,
+            aws_access_key_id=config.S3_ACCESS_KEY,
+            aws_secret_access_key=config.S3_SECRET_KEY,
+        )
+        s3_executor = ThreadPoolExecutor(max_workers=config.S3_UPLOAD_CONCURRENCY, thread_name_prefix="comfy-deploy-s3")
+    return s3_client
+
+
+def upload_file_to_s3(source: Any, key: str, filename: str) -> str:
+    """
+    Upload one file path or in-memory output, large files are sent as a multipart upload.
+    Runs in the upload thread pool
+
+    Returns:
+        Object URL
+    """
+    client = get_s3_client()
+    transfer_config = TransferConfig(
+        multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=config.S3_MULTIPART_CHUNK_SIZE,
+        max_concurrency=config.S3_MULTIPART_CONCURRENCY,
+    )
+    extra_args = {"ContentType": mimetypes.guess_type(filename)[0] or "application/octet-stream"}
+    if isinstance(source, bytes):
+        client.upload_fileobj(BytesIO(source), config.S3_BUCKET, key, ExtraArgs=extra_args, Config=transfer_config)
+    else:
+        client.upload_file(source, config.S3_BUCKET, key, ExtraArgs=extra_args, Config=transfer_config)
+
+    if config.S3_PRESIGN_EXPIRES > 0:
+        return client.generate_presigned_url(
+            "get_object", Params={"Bucket": config.S3_BUCKET, "Key": key}, ExpiresIn=config.S3_PRESIGN_EXPIRES
+        )
+    if config.S3_PUBLIC_BASE_URL:
+        return f"{config.S3_PUBLIC_BASE_URL.rstrip('/')}/{key}"
+    if config.S3_ENDPOINT_URL:
+        return f"{config.S3_ENDPOINT_URL.rstrip('/')}/{config.S3_BUCKET}/{key}"
+    return f"https://{config.S3_BUCKET}.s3.{config.S3_REGION or 'us-east-1'}.amazonaws.com/{key}"
+
+
+async def upload_task_outputs(prompt_id: str, result: dict) -> None:
+    """
+    Upload all output files of a task concurrently and put the object URL into each result item
+
+    Parameters:
+        prompt_id: task ID
+        result: result index, items are replaced by copies with an added `url`
+    """
+    if boto3 is None:
+        logger.warning("[comfy-deploy] S3 upload is enabled but boto3 is not installed, skip uploading outputs")
+        return
+    if not config.S3_BUCKET:
+        logger.warning("[comfy-deploy] S3 upload is enabled but no bucket is configured, skip uploading outputs")
+        return
+
+    get_s3_client()
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+
+    async def upload_item(category: str, index: int, item: dict) -> bool:
+        source = resolve_output_source(item)
+        if source is None:
+            return False
+        filename = os.path.basename(item["filename"])
+        key = "/".join(part for part in (
+            config.S3_KEY_PREFIX.strip("/"), prompt_id, item.get("subfolder") or "", filename
+        ) if part)
+        try:
+            url = await loop.run_in_executor(s3_executor, upload_file_to_s3, source, key, filename)
+            # Copy the item, the original dict is shared with ComfyUI history
+            result[category][index] = {**item, "url": url}
+            return True
+        except Exception as e:
+            logger.error(f"[comfy-deploy] Upload output {filename} of task {prompt_id} failed: {str(e)}")
+            return False
+
+    uploads = [
+        upload_item(category, index, item)
+        for category, items in result.items()
+        for index, item in enumerate(items)
+    ]
+    uploaded = sum(await asyncio.gather(*uploads))
+    logger.info(f"[comfy-deploy] Uploaded {uploaded}/{len(uploads)} outputs of task {prompt_id} "
+                f"in {time.time() - start_time:.2f}s")
 
 
 # ========================= Utility functions =========================
@@ -1376,6 +3026,172 @@ def get_node_class_type(prompt_id: str, node_id: str) -> str:
     return class_type
 
 
+def resolve_output_file(item: dict) -> Optional[str]:
+    """
+    Resolve an output item ({filename, subfolder, type}) to a file path inside its ComfyUI directory
+
+    Parameters:
+        item: output item
+
+    Returns:
+        Absolute file path, or None if the file does not exist or escapes its directory
+    """
+    if not isinstance(item, dict) or not item.get("filename"):
+        return None
+
+    base_dir = folder_paths.get_directory_by_type(item.get("type") or "output")
+    if base_dir is None:
+        return None
+
+    base_dir = os.path.abspath(base_dir)
+    file_path = os.path.abspath(os.path.join(base_dir, item.get("subfolder") or "", item["filename"]))
+    if os.path.commonpath((file_path, base_dir)) != base_dir:
+        return None
+
+    return file_path if os.path.isfile(file_path) else None
+
+
+def resolve_output_source(item: dict) -> Any:
+    """
+    Resolve an output item to its content source
+
+    Parameters:
+        item: output item, `type` is "memory" for outputs held in the in-memory output store
+
+    Returns:
+        bytes for outputs held in memory, a file path otherwise, or None if not found
+    """
+    if not isinstance(item, dict) or not item.get("filename"):
+        return None
+
+    if item.get("type") == "memory":
+        stored = output_store.get(item.get("key", ""))
+        if stored is None:
+            return None
+        data, path, _ = stored
+        return data if data is not None else path
+
+    return resolve_output_file(item)
+
+
+def content_disposition(disposition: str, filename: str) -> str:
+    """
+    Build a Content-Disposition header value per RFC 6266
+
+    The filename* parameter carries the percent-encoded UTF-8 name, the plain filename parameter is an
+    ASCII fallback with quotes and backslashes dropped for clients that ignore filename*
+    """
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "").replace("\\", "")
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def memory_output_response(request, data: bytes, key: str, filename: str = None,
+                           content_type: str = None) -> web.Response:
+    """
+    Build a response for in-memory output bytes with ETag/If-None-Match and single Range support
+
+    Parameters:
+        request: aiohttp request
+        data: output bytes
+        key: content key, used as ETag
+        filename: optional filename for Content-Disposition and content type
+        content_type: optional content type
+    """
+    headers = {
+        "Cache-Control": f"private, max-age={config.OUTPUT_FILE_CACHE_MAX_AGE}",
+        "ETag": f'"{key}"',
+        "Accept-Ranges": "bytes"
+    }
+    if filename:
+        headers["Content-Disposition"] = content_disposition("inline", filename)
+    content_type = content_type or mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+
+    if_none_match = request.if_none_match
+    if if_none_match and any(etag.value in (key, "*") for etag in if_none_match):
+        return web.Response(status=304, headers=headers)
+
+    try:
+        http_range = request.http_range
+    except ValueError:
+        return web.Response(status=416, headers={"Content-Range": f"bytes */{len(data)}"})
+
+    if http_range.start is not None or http_range.stop is not None:
+        start, stop, _ = http_range.indices(len(data))
+        if start >= stop:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(data)}"
+        return web.Response(status=206, body=data[start:stop], headers=headers, content_type=content_type)
+
+    return web.Response(body=data, headers=headers, content_type=content_type)
+
+
+def get_task_output_items(prompt_id: str, node_id: str = None) -> Optional[list]:
+    """
+    Get the output items of a task from history, or from the output index while it is running
+
+    Parameters:
+        prompt_id: task ID
+        node_id: optional node ID, only return outputs of this node
+
+    Returns:
+        List of output items tagged with node_id, or None if the task is unknown
+    """
+    outputs = None
+    history = server.PromptServer.instance.prompt_queue.get_history(prompt_id)
+    if history and prompt_id in history:
+        outputs = history[prompt_id].get("outputs", {})
+    elif prompt_id in task_manager.execution_outputs:
+        outputs = task_manager.get_task_result(prompt_id)[1]
+
+    if outputs is None:
+        return None
+
+    items = []
+    for output_node_id, output in outputs.items():
+        if node_id and output_node_id != node_id:
+            continue
+        result = new_result_index()
+        classify_output(output, result)
+        for category in result.values():
+            items.extend({**item, "node_id": output_node_id} for item in category if isinstance(item, dict))
+    return items
+
+
+class ZipStreamWriter:
+    """Unseekable file object that forwards zip bytes from a worker thread to a StreamResponse"""
+
+    def __init__(self, response: web.StreamResponse, loop: asyncio.AbstractEventLoop, chunk_size: int):
+        self.response = response
+        self.loop = loop
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        # Wait for the write so a slow client applies backpressure instead of growing the buffer
+        asyncio.run_coroutine_threadsafe(self.response.write(chunk), self.loop).result()
+
+
+def write_zip_archive(writer: ZipStreamWriter, files: list) -> None:
+    """Write files (path or in-memory bytes) into an uncompressed zip archive, runs in an executor thread"""
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for source, arcname in files:
+            if isinstance(source, bytes):
+                zf.writestr(zipfile.ZipInfo(arcname, time.localtime()[:6]), source)
+            else:
+                zf.write(source, arcname)
+    writer.flush()
+
+
 # ========================= Event registration and initialization =========================
 # Register ComfyUI event handlers
 event_handler.register_event("progress", handle_progress_event_with_throttle)
@@ -1385,6 +3201,7 @@ EXECUTION_EVENTS = [
     "executing",
     "executed",
     "execution_error",
+    "execution_interrupted",
     "execution_success"
 ]
 for _event_name in EXECUTION_EVENTS:
@@ -1396,8 +3213,15 @@ for _event_name in EXECUTION_EVENTS:
 logger.info("[ComfyDeploy] custom routes initialization completed")
 logger.info("Registered API endpoint: /comfy-deploy/status")
 logger.info("Registered API endpoint: /api/v1/execute")
+logger.info("Registered API endpoint: /api/v1/upload")
 logger.info("Registered API endpoint: /api/v1/status/{prompt_id}")
+logger.info("Registered API endpoint: DELETE /api/v1/task/{prompt_id}")
+logger.info("Registered API endpoint: DELETE /api/v1/tasks?client_id=")
 logger.info("Registered API endpoint: /api/v1/output/{prompt_id}/{node_id}")
+logger.info("Registered API endpoint: /api/v1/output/{prompt_id}/{node_id}/file/{index}")
+logger.info("Registered API endpoint: /api/v1/archive/{prompt_id}")
+logger.info("Registered API endpoint: /api/v1/blob/{key}")
+logger.info("Registered API endpoint: /api/v1/cache/stats")
 logger.info("Registered WebSocket endpoint: /api/v1/ws/task/{prompt_id}")
 logger.info("Registered WebSocket endpoint: /api/v1/ws/machine/{machine_id}")
 logger.info(f"Detailed logging status: {'Enabled' if check_verbose_logging() else 'Disabled'}")
@@ -6,13 +6,10 @@
 """
 
 import folder_paths
-import httpx
-from PIL import Image, ImageOps
-import numpy as np
-import torch
-from io import BytesIO
 import base64
-from comfydeploy_utils import is_valid_url
+from comfydeploy_utils import (
+    is_valid_url, is_upload_handle, fetch_image_bytes, fetch_input_bytes, load_image_tensor, CircuitOpenError
+)
 
 
 class ComfyDeployExternalImage:
@@ -33,6 +30,8 @@ class ComfyDeployExternalImage:
                     "STRING",
                     {"multiline": True, "default": ""},
                 ),
+                # Downscale inputs larger than this while decoding, 0 keeps the original size
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 8}),
             }
         }
 
@@ -44,56 +43,45 @@ class ComfyDeployExternalImage:
     CATEGORY = "comfy-deploy/Image"
 
     @staticmethod
-    def load_image(param_name, keep_alpha_channel, default_value=None, display_name=None, description=None):
+    def load_image(param_name, keep_alpha_channel, default_value=None, display_name=None, description=None,
+                   max_side=0):
         input_image = param_name
 
-        return_image = None
+        content = None
         if input_image and input_image.startswith('http'):
             print(f"comfy-deploy: Fetching image from url: {input_image}")
 
-            retry_count = 3
-            have_retry = 0
-            for i in range(retry_count):
-                have_retry += 1
-                try:
-                    if not is_valid_url(input_image):
-                         print(f"comfy-deploy: Invalid image url provided. {input_image}")
-                         return [default_value]
-                    headers = {
-                        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0'
-                    }
-                    response = httpx.get(input_image, timeout=60.0, headers=headers, follow_redirects=True)
-                    if response.status_code == 200:
-                        return_image = Image.open(BytesIO(response.content))
-                        print(f"comfy-deploy: Success Load image from url: {input_image}")
-                        break
-                    else:
-                        print(f"comfy-deploy: Failed to retrieve the image, status code: {response.status_code}")
-                except Exception as e:
-                    print(f'Warning({have_retry}): comfy-deploy download image URL failed. Image URL: {input_image}. Error: {e}')
+            if not is_valid_url(input_image):
+                print(f"comfy-deploy: Invalid image url provided. {input_image}")
+                return [default_value]
+
+            try:
+                content = fetch_image_bytes(input_image)
+            except CircuitOpenError as e:
+                print(e)
+                if default_value is not None:
+                    print(f'comfy-deploy: Input image: {param_name} host is unavailable, use default image')
+                    return [default_value]
+
+        elif is_upload_handle(input_image):
+            print(f"comfy-deploy: Loading uploaded image: {input_image}")
+            content = fetch_input_bytes(input_image)
 
         elif input_image and input_image.startswith('data:image/png;base64,') or input_image.startswith(
                 'data:image/jpeg;base64,') or input_image.startswith('data:image/jpg;base64,'):
 
             print("Decoding base64 image")
             base64_image = input_image[input_image.find(",") + 1:]
-            decoded_image = base64.b64decode(base64_image)
-            return_image = Image.open(BytesIO(decoded_image))
+            content = base64.b64decode(base64_image)
 
         else:
             print(f'comfy-deploy: Input image: {param_name} is empty, use default image')
             return [default_value]
 
-        if not return_image:
+        if not content:
             raise RuntimeError(f'Error: comfy-deploy load image failed. input_image: {input_image}')
 
-        image = ImageOps.exif_transpose(return_image)
-        if keep_alpha_channel:
-            image = image.convert("RGBA")
-        else:
-            image = image.convert("RGB")
-        image = np.array(image).astype(np.float32) / 255.0
-        image = torch.from_numpy(image)[None, ]
+        image = load_image_tensor(content, keep_alpha_channel, max_side)
         return [image]
 
 
@@ -6,15 +6,14 @@
 """
 
 import folder_paths
-import httpx
-from PIL import Image, ImageOps
-import numpy as np
 import torch
-from io import BytesIO
 import base64
-import json
-    
-from comfydeploy_utils import is_valid_url
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from comfydeploy_utils import (
+    is_valid_url, is_upload_handle, fetch_input_bytes, load_image_tensor, open_image, prepare_image, stack_images,
+    parse_image_url_list, CircuitOpenError, DOWNLOAD_CONCURRENCY, DECODE_WORKERS
+)
 
 
 class ComfyDeployExternalImageBatch:
@@ -35,76 +34,97 @@ class ComfyDeployExternalImageBatch:
                     "STRING",
                     {"multiline": True, "default": ""},
                 ),
+                # 0 uses the global DOWNLOAD_CONCURRENCY
+                "max_concurrency": ("INT", {"default": 0, "min": 0, "max": 64}),
+                # list: one [1,H,W,C] tensor per image, batch: one [N,H,W,C] tensor sized by resize_policy
+                "output_mode": (["list", "batch"], {"default": "list"}),
+                "resize_policy": (["resize", "crop", "pad"], {"default": "resize"}),
+                # Downscale inputs larger than this while decoding, 0 keeps the original size
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 8}),
+                # 0 uses the global DECODE_WORKERS
+                "decode_workers": ("INT", {"default": 0, "min": 0, "max": 64}),
             }
         }
 
-    RETURN_TYPES = ("IMAGE",)
-    RETURN_NAMES = ("image",)
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
     FUNCTION = "load_image_batch"
     CATEGORY = "comfy-deploy/Image"
-    OUTPUT_IS_LIST = (True,)
+    OUTPUT_IS_LIST = (True, True)
 
     @staticmethod
-    def load_image_batch(param_name, keep_alpha_channel, default_value=None, display_name=None, description=None):
+    def load_image_batch(param_name, keep_alpha_channel, default_value=None, display_name=None, description=None,
+                         max_concurrency=0, output_mode="list", resize_policy="resize", max_side=0, decode_workers=0):
         input_images = default_value
 
-        return_image = None
-        image_list = []
-        if isinstance(input_images, str):
-            if "[" in input_images and "]" in input_images:
-                if '["' in input_images or f"[\"" in input_images:
-                    try:
-                        json_data = json.loads(input_images)
-                    except json.JSONDecodeError:
-                        raise RuntimeError(f"comfy-deploy: Input image: {param_name} is not a valid JSON, use default image")
-                else:
-                    input_images = input_images.split("[")[-1].split("]")[0]
-                    json_data = [x.strip() for x in input_images.split(",")]
-            else:
-                json_data = [x.strip() for x in input_images.split(",")]
-        else:
-            json_data = input_images
+        try:
+            json_data = parse_image_url_list(input_images)
+        except ValueError:
+            raise RuntimeError(f"comfy-deploy: Input image: {param_name} is not a valid JSON, use default image")
 
-        print(f"comfy-deploy: Fetching image from url: {input_images}")
+        image_urls = []
         for image_url in json_data:
-            retry_count = 3
-            have_retry = 0
+            if is_upload_handle(image_url):
+                image_urls.append(image_url)
+                continue
             if image_url.strip() == "" or not image_url.strip().startswith("http"):
                 continue
-            for i in range(retry_count):
-                have_retry += 1
+            if not is_valid_url(image_url):
+                print(f"comfy-deploy: Invalid image url provided. {image_url}")
+                continue
+            image_urls.append(image_url)
+
+        print(f"comfy-deploy: Fetching image from url: {input_images}")
+        max_workers = max(1, min(max_concurrency or DOWNLOAD_CONCURRENCY, len(image_urls) or 1))
+
+        decode_workers = max(1, min(decode_workers or DECODE_WORKERS, len(image_urls) or 1))
+
+        # Downloads share the pooled client, completed images are decoded in a second pool while the others
+        # are in flight. Results are placed by index so the output order matches the input order
+        image_list = [None] * len(image_urls)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="comfy-deploy-download") as executor, \
+                ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="comfy-deploy-decode") as decoder:
+            futures = {
+                executor.submit(fetch_input_bytes, image_url): index
+                for index, image_url in enumerate(image_urls)
+            }
+            decode_futures = {}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    content = future.result()
+                except CircuitOpenError as e:
+                    print(e)
+                    continue
+                if content is None:
+                    continue
+                decode_futures[decoder.submit(ComfyDeployExternalImageBatch.decode_image, content,
+                                              keep_alpha_channel, output_mode, max_side)] = index
+
+            for future in as_completed(decode_futures):
+                index = decode_futures[future]
                 try:
-                    if not is_valid_url(image_url):
-                        print(f"comfy-deploy: Invalid image url provided. {image_url}")
-                        break
-                    headers = {
-                        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0'
-                    }
-                    response = httpx.get(image_url, timeout=60.0, headers=headers, follow_redirects=True)
-                    if response.status_code == 200:
-                        return_image = Image.open(BytesIO(response.content))
-                        print(f"comfy-deploy: Success Load image from url: {image_url}")
-                        image_list.append(return_image)
-                        break
-                    else:
-                        print(f"comfy-deploy: Failed to retrieve the image, status code: {response.status_code}")
+                    image_list[index] = future.result()
                 except Exception as e:
-                    print(f'Warning({have_retry}): comfy-deploy download image URL failed. Image URL: {image_url}. Error: {e}')
+                    print(f'Warning: comfy-deploy decode image failed. Image URL: {image_urls[index]}. Error: {e}')
 
-        if not image_list:
+        return_image_list = [image for image in image_list if image is not None]
+        if not return_image_list:
             raise RuntimeError(f'Error: comfy-deploy load image failed or empty. input_image: {input_images}')
-        
-        return_image_list = []
-        for return_image in image_list:
-            image = ImageOps.exif_transpose(return_image)
-            if keep_alpha_channel:
-                image = image.convert("RGBA")
-            else:
-                image = image.convert("RGB")
-            image = np.array(image).astype(np.float32) / 255.0
-            image = torch.from_numpy(image)[None, ]
-            return_image_list.append(image)
-        return (return_image_list,)
+
+        if output_mode == "batch":
+            image_batch, mask_batch = stack_images(return_image_list, resize_policy)
+            return ([image_batch], [mask_batch])
+
+        return_mask_list = [torch.zeros(image.shape[:3], dtype=torch.float32) for image in return_image_list]
+        return (return_image_list, return_mask_list)
+
+    @staticmethod
+    def decode_image(content, keep_alpha_channel, output_mode="list", max_side=0):
+        """Decode one downloaded image, runs in the decode pool"""
+        if output_mode == "batch":
+            return prepare_image(open_image(content, max_side), keep_alpha_channel)
+        return load_image_tensor(content, keep_alpha_channel, max_side)
 
 
 NODE_CLASS_MAPPINGS = {"ComfyDeployExternalImageBatch": ComfyDeployExternalImageBatch}
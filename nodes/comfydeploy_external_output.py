@@ -0,0 +1,69 @@
+"""
+@author: Hmily
+@title: comfy-deploy
+@nickname: comfy-deploy
+@description: Easy deploy API for ComfyUI.
+"""
+
+import torch
+from comfydeploy_output_store import output_store, encode_images, MEDIA_TYPES
+
+
+class ComfyDeployExternalOutput:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "param_name": ("STRING", {"multiline": False, "default": "output_image"}),
+                "format": (["webp", "jpeg", "png"], {"default": "webp"}),
+                "quality": ("INT", {"default": 90, "min": 1, "max": 100}),
+            },
+            "optional": {
+                "display_name": (
+                    "STRING",
+                    {"multiline": False, "default": ""},
+                ),
+                "description": (
+                    "STRING",
+                    {"multiline": True, "default": ""},
+                ),
+            }
+        }
+
+    RETURN_TYPES = ()
+    OUTPUT_NODE = True
+
+    FUNCTION = "save_output"
+
+    CATEGORY = "comfy-deploy/Image"
+
+    @staticmethod
+    def save_output(images, param_name, format="webp", quality=90, display_name=None, description=None):
+        # Convert the whole batch to uint8 once, the pool only encodes
+        arrays = images.mul(255.0).clamp_(0, 255).to(torch.uint8).cpu().numpy()
+        encoded = encode_images(arrays, format, quality)
+
+        results = []
+        for array, data in zip(arrays, encoded):
+            key = output_store.put(data, MEDIA_TYPES[format])
+            results.append({
+                "filename": f"{key}.{format}",
+                "subfolder": "",
+                "type": "memory",
+                "key": key,
+                # Served by /api/v1/blob/{key}, replaced by the object URL when outputs are uploaded to S3
+                "url": f"/api/v1/blob/{key}",
+                "param_name": param_name,
+                "format": format,
+                "width": int(array.shape[1]),
+                "height": int(array.shape[0]),
+                "size": len(data),
+            })
+        print(f"comfy-deploy: Stored {len(results)} {format} outputs in memory for {param_name}")
+        # Not under "images", the ComfyUI frontend would try to preview them through /view
+        return {"ui": {"comfy_deploy_images": results}}
+
+
+NODE_CLASS_MAPPINGS = {"ComfyDeployExternalOutput": ComfyDeployExternalOutput}
+NODE_DISPLAY_NAME_MAPPINGS = {"ComfyDeployExternalOutput": "External Output (ComfyDeploy)"}
@@ -0,0 +1,177 @@
+"""
+@author: Hmily
+@title: comfy-deploy
+@nickname: comfy-deploy
+@description: Easy deploy API for ComfyUI.
+"""
+
+import os
+import json
+import struct
+import folder_paths
+import numpy as np
+import torch
+
+# Directories arrays may be loaded from, separated by os.pathsep. The ComfyUI input directory when unset
+TENSOR_INPUT_ROOTS = os.environ.get("COMFY_DEPLOY_TENSOR_ROOTS", "")
+FILE_SCHEME = "file://"
+
+# safetensors dtypes numpy can map, bfloat16 has no numpy equivalent
+SAFETENSORS_DTYPES = {
+    "F32": np.float32,
+    "F16": np.float16,
+    "F64": np.float64,
+    "U8": np.uint8,
+}
+
+
+def get_tensor_roots():
+    if TENSOR_INPUT_ROOTS:
+        return [os.path.abspath(root) for root in TENSOR_INPUT_ROOTS.split(os.pathsep) if root]
+    return [os.path.abspath(folder_paths.get_input_directory())]
+
+
+def resolve_array_path(value):
+    """
+    Resolve a path or file:// url to a .npy/.safetensors file inside one of the allowed roots
+
+    Returns:
+        Absolute file path, or None if the file does not exist or is outside the allowed roots
+    """
+    if value.startswith(FILE_SCHEME):
+        value = value[len(FILE_SCHEME):]
+    if not value.endswith((".npy", ".safetensors")):
+        return None
+
+    for root in get_tensor_roots():
+        file_path = os.path.abspath(os.path.join(root, value))
+        if os.path.commonpath((file_path, root)) == root and os.path.isfile(file_path):
+            return file_path
+    return None
+
+
+def map_safetensors(path, key=""):
+    """
+    Memory-map one tensor of a .safetensors file without reading its data
+
+    The file is an 8 byte little-endian header size, a JSON header with the dtype, shape and data offsets
+    of each tensor, then the raw tensor data
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    if not header:
+        raise ValueError("file holds no tensors")
+    if not key:
+        if len(header) > 1:
+            raise ValueError(f"file holds several tensors, set key to one of {sorted(header)}")
+        key = next(iter(header))
+    if key not in header:
+        raise ValueError(f"tensor {key} not found, available: {sorted(header)}")
+
+    info = header[key]
+    dtype = SAFETENSORS_DTYPES.get(info["dtype"])
+    if dtype is None:
+        raise ValueError(f"unsupported dtype {info['dtype']}")
+    start, end = info["data_offsets"]
+    shape = tuple(info["shape"])
+    if end - start != int(np.prod(shape)) * np.dtype(dtype).itemsize:
+        raise ValueError("data size does not match the shape")
+    # Copy-on-write, the tensor is writable but changes never reach the file
+    return np.memmap(path, dtype=dtype, mode="c", offset=8 + header_size + start, shape=shape)
+
+
+def map_array(path, key=""):
+    if path.endswith(".safetensors"):
+        return map_safetensors(path, key)
+    return np.load(path, mmap_mode="c", allow_pickle=False)
+
+
+def array_to_tensor(array, tensor_type):
+    """
+    Wrap a mapped array as an IMAGE [N,H,W,C] or MASK [N,H,W] tensor, float32 arrays are not copied
+
+    Raises:
+        ValueError: if the shape or dtype does not fit the tensor type
+    """
+    if tensor_type == "IMAGE":
+        if array.ndim == 3:
+            array = array[None]
+        if array.ndim != 4 or array.shape[-1] not in (3, 4):
+            raise ValueError(f"IMAGE arrays must be [N,H,W,C] or [H,W,C] with 3 or 4 channels, got {array.shape}")
+    else:
+        if array.ndim == 2:
+            array = array[None]
+        if array.ndim != 3:
+            raise ValueError(f"MASK arrays must be [N,H,W] or [H,W], got {array.shape}")
+    if 0 in array.shape:
+        raise ValueError(f"array is empty, got {array.shape}")
+
+    if array.dtype == np.float32:
+        return torch.from_numpy(array)
+    if array.dtype == np.uint8:
+        print(f"comfy-deploy: Converting uint8 array {array.shape} to float32")
+        return torch.from_numpy(np.divide(array, np.float32(255.0), dtype=np.float32))
+    if array.dtype in (np.float16, np.float64):
+        print(f"comfy-deploy: Converting {array.dtype} array {array.shape} to float32")
+        return torch.from_numpy(array.astype(np.float32))
+    raise ValueError(f"unsupported dtype {array.dtype}, expected float32, float16, float64 or uint8")
+
+
+class ComfyDeployExternalTensor:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "param_name": ("STRING", {"multiline": False, "default": "input_tensor"}),
+                "tensor_type": (["IMAGE", "MASK"], {"default": "IMAGE"}),
+            },
+            "optional": {
+                # Path or file:// url of a .npy/.safetensors file inside the allowed roots
+                "default_value": ("STRING", {"multiline": False, "default": ""}),
+                "display_name": (
+                    "STRING",
+                    {"multiline": False, "default": ""},
+                ),
+                "description": (
+                    "STRING",
+                    {"multiline": True, "default": ""},
+                ),
+                # Tensor name in a .safetensors file, may be empty if the file holds one tensor
+                "key": ("STRING", {"multiline": False, "default": ""}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "MASK")
+    RETURN_NAMES = ("image", "mask")
+
+    FUNCTION = "load_tensor"
+
+    CATEGORY = "comfy-deploy/Image"
+
+    @staticmethod
+    def load_tensor(param_name, tensor_type, default_value="", display_name=None, description=None, key=""):
+        value = default_value.strip() if default_value else ""
+        path = resolve_array_path(value) if value else None
+        if path is None:
+            raise RuntimeError(f"comfy-deploy: Input tensor: {param_name} is empty or not found: {default_value}")
+
+        try:
+            tensor = array_to_tensor(map_array(path, key.strip() if key else ""), tensor_type)
+        except (ValueError, OSError) as e:
+            raise RuntimeError(f"comfy-deploy: Input tensor: {param_name} is invalid: {e}. File: {path}")
+
+        print(f"comfy-deploy: Mapped {tensor_type} {tuple(tensor.shape)} from {path}")
+        # The companion output is a real tensor, downstream nodes may write to it in place
+        if tensor_type == "IMAGE":
+            if tensor.shape[-1] == 4:
+                mask = 1.0 - tensor[..., 3]
+            else:
+                mask = torch.zeros(tensor.shape[:3], dtype=torch.float32)
+            return (tensor, mask)
+        return (tensor.unsqueeze(-1).repeat(1, 1, 1, 3), tensor)
+
+
+NODE_CLASS_MAPPINGS = {"ComfyDeployExternalTensor": ComfyDeployExternalTensor}
+NODE_DISPLAY_NAME_MAPPINGS = {"ComfyDeployExternalTensor": "External Tensor (ComfyDeploy)"}
@@ -0,0 +1,183 @@
+"""
+@author: Hmily
+@title: comfy-deploy
+@nickname: comfy-deploy
+@description: Easy deploy API for ComfyUI.
+"""
+
+import os
+import math
+import folder_paths
+import cv2
+import numpy as np
+import torch
+
+from comfydeploy_utils import is_valid_url, is_upload_handle, resolve_upload_path
+
+# Initial frame buffer of streams without a frame count, doubled whenever it is full
+VIDEO_FRAME_CHUNK = 64
+
+
+class ComfyDeployExternalVideo:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "param_name": ("STRING", {"multiline": False, "default": "input_video"}),
+            },
+            "optional": {
+                # Video url, upload://<id> handle or a path relative to the ComfyUI input directory
+                "default_value": ("STRING", {"multiline": False, "default": ""}),
+                "display_name": (
+                    "STRING",
+                    {"multiline": False, "default": ""},
+                ),
+                "description": (
+                    "STRING",
+                    {"multiline": True, "default": ""},
+                ),
+                # 0 keeps the frame rate of the video
+                "fps": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 240.0, "step": 0.01}),
+                "start_time": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 86400.0, "step": 0.01}),
+                # 0 reads to the end of the video
+                "end_time": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 86400.0, "step": 0.01}),
+                # 0 keeps all sampled frames
+                "max_frames": ("INT", {"default": 0, "min": 0, "max": 100000}),
+                # Downscale frames larger than this while decoding, 0 keeps the original size
+                "max_side": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 8}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "INT", "FLOAT")
+    RETURN_NAMES = ("frames", "frame_count", "fps")
+
+    FUNCTION = "load_video"
+
+    CATEGORY = "comfy-deploy/Video"
+
+    @staticmethod
+    def load_video(param_name, default_value="", display_name=None, description=None, fps=0.0, start_time=0.0,
+                   end_time=0.0, max_frames=0, max_side=0):
+        source = ComfyDeployExternalVideo.resolve_source(default_value.strip() if default_value else "")
+        if source is None:
+            raise RuntimeError(f"comfy-deploy: Input video: {param_name} is empty or not found: {default_value}")
+
+        print(f"comfy-deploy: Loading video: {default_value}")
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise RuntimeError(f"comfy-deploy: Open video failed. Input video: {default_value}")
+
+        try:
+            frames, frame_count, sample_fps = ComfyDeployExternalVideo.read_frames(
+                capture, fps, start_time, end_time, max_frames, max_side
+            )
+        finally:
+            capture.release()
+
+        if frame_count == 0:
+            raise RuntimeError(f"comfy-deploy: No frames decoded. Input video: {default_value}")
+
+        print(f"comfy-deploy: Loaded {frame_count} frames {tuple(frames.shape[1:3])} at {sample_fps:.2f} fps "
+              f"from video: {default_value}")
+        return (frames, frame_count, sample_fps)
+
+    @staticmethod
+    def resolve_source(value):
+        """Map the input value to a url or file path cv2 can open, or None"""
+        if not value:
+            return None
+        if value.startswith("http"):
+            return value if is_valid_url(value) else None
+        if is_upload_handle(value):
+            return resolve_upload_path(value)
+
+        # Local files are limited to the ComfyUI input directory
+        base_dir = os.path.abspath(folder_paths.get_input_directory())
+        file_path = os.path.abspath(os.path.join(base_dir, value))
+        if os.path.commonpath((file_path, base_dir)) != base_dir or not os.path.isfile(file_path):
+            return None
+        return file_path
+
+    @staticmethod
+    def read_frames(capture, fps, start_time, end_time, max_frames, max_side):
+        """
+        Stream frames from an opened capture into a preallocated IMAGE tensor
+
+        Frames between samples are only grabbed, not decoded. The tensor is sized from the frame count
+        of the container when it is known, otherwise it starts at VIDEO_FRAME_CHUNK frames and doubles
+
+        Returns:
+            Tuple (frames [N,H,W,3] tensor or None, frame count, frame rate of the sampled frames)
+        """
+        source_fps = capture.get(cv2.CAP_PROP_FPS)
+        if not source_fps or math.isnan(source_fps) or source_fps <= 0:
+            source_fps = 30.0
+        sample_fps = float(min(fps, source_fps) if fps > 0 else source_fps)
+        sample_interval = 1.0 / sample_fps
+
+        start_frame = int(start_time * source_fps)
+        if start_frame > 0 and not capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+            # Not seekable, skip frames without decoding them
+            for _ in range(start_frame):
+                if not capture.grab():
+                    break
+
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        end_frame = int(end_time * source_fps) if end_time > start_time else None
+        if total_frames > 0:
+            end_frame = min(end_frame, total_frames) if end_frame is not None else total_frames
+        if end_frame is not None:
+            capacity = max(0, math.ceil((end_frame - start_frame) / source_fps * sample_fps))
+            if max_frames > 0:
+                capacity = min(capacity, max_frames)
+        else:
+            capacity = max_frames if max_frames > 0 else VIDEO_FRAME_CHUNK
+
+        # Allocated on the first frame, some streams only report their size once decoding starts
+        frames = None
+        rgb = height = width = None
+        count = 0
+        frame_index = start_frame
+        next_sample_time = start_frame / source_fps
+        while end_frame is None or frame_index < end_frame:
+            if max_frames > 0 and count >= max_frames:
+                break
+            if not capture.grab():
+                break
+            frame_time = frame_index / source_fps
+            frame_index += 1
+            # Half a source frame of tolerance keeps rounding from dropping samples
+            if frame_time + 0.5 / source_fps < next_sample_time:
+                continue
+            next_sample_time += sample_interval
+
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            if frames is None:
+                height, width = frame.shape[:2]
+                if max_side > 0 and max(width, height) > max_side:
+                    scale = max_side / max(width, height)
+                    width, height = max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+                frames = torch.empty((max(capacity, 1), height, width, 3), dtype=torch.float32)
+                rgb = np.empty((height, width, 3), dtype=np.uint8)
+            if frame.shape[:2] != (height, width):
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            if count >= frames.shape[0]:
+                grown = torch.empty((frames.shape[0] * 2, height, width, 3), dtype=torch.float32)
+                grown[:count] = frames[:count]
+                frames = grown
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+            np.divide(rgb, np.float32(255.0), out=frames[count].numpy())
+            count += 1
+
+        if frames is None:
+            return None, 0, sample_fps
+        if count < frames.shape[0]:
+            # A slice would keep the whole over-allocated buffer alive
+            return frames[:count].clone(), count, sample_fps
+        return frames, count, sample_fps
+
+
+NODE_CLASS_MAPPINGS = {"ComfyDeployExternalVideo": ComfyDeployExternalVideo}
+NODE_DISPLAY_NAME_MAPPINGS = {"ComfyDeployExternalVideo": "External Video (ComfyDeploy)"}
@@ -0,0 +1,153 @@
+import os
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Encoded outputs kept in memory, least recently used entries are spilled to disk or dropped
+OUTPUT_STORE_MAX_BYTES = 512 * 1024 * 1024
+OUTPUT_STORE_SPILL_TO_DISK = True
+OUTPUT_STORE_MAX_SPILL_BYTES = 4 * 1024 * 1024 * 1024
+# PIL encoders release the GIL, so a thread pool encodes a batch on several cores
+ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+# WebP method 0 is the fastest encoder setting
+WEBP_METHOD = 0
+
+MEDIA_TYPES = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="comfy-deploy-encode")
+
+
+def get_spill_directory():
+    import folder_paths
+    return os.path.join(folder_paths.get_temp_directory(), "comfy-deploy-outputs")
+
+
+class OutputStore:
+    """Bounded LRU store of encoded output bytes, keyed by content hash"""
+
+    def __init__(self, max_bytes, spill_to_disk=True, max_spill_bytes=0):
+        self.max_bytes = max_bytes
+        self.spill_to_disk = spill_to_disk
+        self.max_spill_bytes = max_spill_bytes
+        self.items = OrderedDict()  # key -> {"data": bytes or None, "path": spill path or None, "media_type", "size"}
+        self.total_bytes = 0
+        self.spill_bytes = 0
+        self.lock = threading.Lock()
+
+    def put(self, data, media_type):
+        key = hashlib.sha256(data).hexdigest()[:32]
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is not None:
+                self.items.move_to_end(key)
+                return key
+            self.items[key] = {"data": data, "path": None, "media_type": media_type, "size": len(data)}
+            self.total_bytes += len(data)
+            self._evict()
+        return key
+
+    def get(self, key):
+        """
+        Returns:
+            Tuple (data, path, media_type), data is None if the entry was spilled to disk,
+            or None if the key is unknown
+        """
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            self.items.move_to_end(key)
+            return entry["data"], entry["path"], entry["media_type"]
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.items.pop(key, None)
+            if entry is None:
+                return
+            if entry["data"] is not None:
+                self.total_bytes -= entry["size"]
+            else:
+                self.spill_bytes -= entry["size"]
+        self._remove_file(entry["path"])
+
+    def _evict(self):
+        for key in list(self.items.keys()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            entry = self.items[key]
+            if entry["data"] is None:
+                continue
+            self.total_bytes -= entry["size"]
+            if self.spill_to_disk:
+                entry["path"] = self._spill(key, entry["data"])
+                entry["data"] = None
+                if entry["path"]:
+                    self.spill_bytes += entry["size"]
+                    continue
+            del self.items[key]
+
+        # Spilled entries are bounded too, the oldest files are deleted
+        for key in list(self.items.keys()):
+            if self.spill_bytes <= self.max_spill_bytes:
+                break
+            entry = self.items[key]
+            if entry["data"] is not None:
+                continue
+            self.spill_bytes -= entry["size"]
+            self._remove_file(entry["path"])
+            del self.items[key]
+
+    @staticmethod
+    def _remove_file(path):
+        if not path:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _spill(key, data):
+        try:
+            spill_dir = get_spill_directory()
+            os.makedirs(spill_dir, exist_ok=True)
+            path = os.path.join(spill_dir, key)
+            with open(path, "wb") as f:
+                f.write(data)
+            return path
+        except OSError as e:
+            print(f"comfy-deploy: Spill output {key} to disk failed: {e}")
+            return None
+
+
+output_store = OutputStore(OUTPUT_STORE_MAX_BYTES, OUTPUT_STORE_SPILL_TO_DISK, OUTPUT_STORE_MAX_SPILL_BYTES)
+
+
+def encode_image(array, image_format, quality):
+    """Encode one uint8 [H,W,C] array to bytes"""
+    if array.shape[-1] == 1:
+        array = array[..., 0]
+    image = Image.fromarray(array)
+    buffer = BytesIO()
+    if image_format == "jpeg":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    elif image_format == "png":
+        image.save(buffer, format="PNG", compress_level=1)
+    else:
+        image.save(buffer, format="WEBP", quality=quality, method=WEBP_METHOD)
+    return buffer.getvalue()
+
+
+def encode_images(arrays, image_format, quality):
+    """Encode a uint8 [N,H,W,C] array in the encode pool, keeps the batch order"""
+    return list(encode_executor.map(lambda array: encode_image(np.ascontiguousarray(array), image_format, quality),
+                                    arrays))
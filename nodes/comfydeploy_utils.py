@@ -1,6 +1,87 @@
+import os
 import re
+import math
+import json
+import time
+import random
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse
 
+import httpx
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+DOWNLOAD_HEADERS = {
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0'
+}
+DOWNLOAD_CONNECT_TIMEOUT = 10.0
+DOWNLOAD_READ_TIMEOUT = 30.0
+DOWNLOAD_TIMEOUT = httpx.Timeout(60.0, connect=DOWNLOAD_CONNECT_TIMEOUT, read=DOWNLOAD_READ_TIMEOUT)
+DOWNLOAD_RETRY_COUNT = 3
+# Exponential backoff with jitter between retries (seconds)
+DOWNLOAD_RETRY_BACKOFF = 0.5
+DOWNLOAD_RETRY_BACKOFF_MAX = 8.0
+# A second request is sent when the first one is slower than the p95 latency of its host
+HEDGE_ENABLED = True
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WORKERS = 16
+# Hosts failing this many times in a row are skipped for CIRCUIT_OPEN_SECONDS
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 30.0
+# Default number of images downloaded at the same time by the batch node
+DOWNLOAD_CONCURRENCY = 4
+# PIL decoders release the GIL, batch inputs are decoded on this many threads
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+# Connection pool of the shared http client used by all image input nodes
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+HTTP_KEEPALIVE_EXPIRY = 60.0
+# HTTP/2 is used only if the h2 package is installed
+HTTP2_ENABLED = True
+
+# On-disk cache of downloaded input images
+IMAGE_CACHE_ENABLED = True
+IMAGE_CACHE_DIR = os.environ.get("COMFY_DEPLOY_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "images"
+)
+IMAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Cached urls younger than this (seconds) are used without contacting the server, older ones are revalidated
+IMAGE_CACHE_FRESHNESS = 300
+
+# In-memory cache of decoded IMAGE tensors, keyed by content hash and alpha mode
+TENSOR_CACHE_ENABLED = True
+TENSOR_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Input images found in submitted prompts are downloaded while the task waits in the queue
+PREFETCH_ENABLED = True
+PREFETCH_WORKERS = 4
+PREFETCH_MAX_ENTRIES = 256
+# Seconds a prefetched image waits for its node before it is dropped
+PREFETCH_TTL = 1800
+
+_prefetched = {}  # url -> (Future of content, start time)
+_prefetch_lock = threading.Lock()
+_prefetch_executor = None
+
+# Raw input files uploaded to /api/v1/upload are referenced by nodes as upload://<id>
+UPLOAD_SCHEME = "upload://"
+UPLOAD_DIR = os.environ.get("COMFY_DEPLOY_UPLOAD_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "uploads"
+)
+# Seconds an uploaded file is kept
+UPLOAD_TTL = 3600
+
+_http_client = None
+_http_client_lock = threading.Lock()
+_hedge_executor = None
+
 
 def is_valid_url(url):
     try:
@@ -15,4 +96,636 @@ def is_valid_url(url):
         )
         return bool(url_pattern.match(url))
     except ValueError:
-        return False
\ No newline at end of file
+        return False
+
+def get_http_client():
+    """
+    Get the process-wide pooled http client shared by all image input nodes, connections are kept alive
+    between runs so repeated downloads from the same host skip TCP/TLS setup
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                http2 = False
+                if HTTP2_ENABLED:
+                    try:
+                        import h2  # noqa: F401
+                        http2 = True
+                    except ImportError:
+                        pass
+                _http_client = httpx.Client(
+                    headers=DOWNLOAD_HEADERS,
+                    timeout=DOWNLOAD_TIMEOUT,
+                    follow_redirects=True,
+                    http2=http2,
+                    limits=httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                )
+    return _http_client
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of downloading when the circuit breaker of the url's host is open"""
+
+
+class HostHealth:
+    """Per-host latency samples for request hedging and a consecutive-failure circuit breaker"""
+
+    def __init__(self):
+        self.latencies = {}  # host -> deque of recent successful request durations
+        self.failures = {}  # host -> consecutive failures
+        self.opened_at = {}  # host -> time the circuit was opened
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        """Closed or half-open circuits allow requests, after CIRCUIT_OPEN_SECONDS one trial goes through"""
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.time() - opened_at < CIRCUIT_OPEN_SECONDS:
+                return False
+            # Half-open, a further failure opens the circuit again
+            self.opened_at[host] = time.time()
+            self.failures[host] = CIRCUIT_FAILURE_THRESHOLD - 1
+            return True
+
+    def record_success(self, host, duration):
+        with self.lock:
+            self.failures.pop(host, None)
+            if self.opened_at.pop(host, None) is not None:
+                print(f"comfy-deploy: Host {host} recovered, circuit closed")
+            self.latencies.setdefault(host, deque(maxlen=200)).append(duration)
+
+    def record_failure(self, host):
+        with self.lock:
+            failures = self.failures.get(host, 0) + 1
+            self.failures[host] = failures
+            if failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self.opened_at[host] = time.time()
+                print(f"comfy-deploy: Host {host} failed {failures} times in a row, circuit open "
+                      f"for {CIRCUIT_OPEN_SECONDS}s")
+
+    def hedge_delay(self, host):
+        """p95 latency of the host, or None while there are too few samples"""
+        with self.lock:
+            samples = self.latencies.get(host)
+            if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    def get_stats(self):
+        with self.lock:
+            hosts = set(self.latencies) | set(self.failures) | set(self.opened_at)
+            return {
+                host: {
+                    "samples": len(self.latencies.get(host, ())),
+                    "consecutive_failures": self.failures.get(host, 0),
+                    "circuit_open": host in self.opened_at,
+                }
+                for host in hosts
+            }
+
+
+host_health = HostHealth()
+
+
+class ImageCache:
+    """
+    Size-bounded LRU disk cache of downloaded images. Blobs are stored by content hash so urls serving the
+    same bytes share one file, entries keep ETag/Last-Modified for revalidation
+    """
+
+    def __init__(self, cache_dir, max_bytes, freshness):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        self.freshness = freshness
+        self.entries = OrderedDict()  # url -> {"hash", "size", "etag", "last_modified", "fetched_at"}
+        self.blob_refs = {}  # hash -> number of urls referencing the blob
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "stale": 0, "revalidated": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for url, entry in entries:
+            if os.path.isfile(self._blob_path(entry["hash"])):
+                self._add_entry(url, entry)
+
+    def _save(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"comfy-deploy: Save image cache index failed: {e}")
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.blob_dir, content_hash[:2], content_hash)
+
+    def _add_entry(self, url, entry):
+        self.entries[url] = entry
+        refs = self.blob_refs.get(entry["hash"], 0)
+        if refs == 0:
+            self.total_bytes += entry["size"]
+        self.blob_refs[entry["hash"]] = refs + 1
+
+    def _remove_entry(self, url):
+        entry = self.entries.pop(url)
+        refs = self.blob_refs[entry["hash"]] - 1
+        if refs > 0:
+            self.blob_refs[entry["hash"]] = refs
+            return
+        del self.blob_refs[entry["hash"]]
+        self.total_bytes -= entry["size"]
+        try:
+            os.remove(self._blob_path(entry["hash"]))
+        except OSError:
+            pass
+
+    def lookup(self, url):
+        """
+        Returns:
+            Tuple (content, fresh, entry), content is None on a miss. Stale entries need revalidation
+            with the returned entry's ETag/Last-Modified before use
+        """
+        with self.lock:
+            self._load()
+            entry = self.entries.get(url)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None, False, None
+            self.entries.move_to_end(url)
+            entry = dict(entry)
+        try:
+            with open(self._blob_path(entry["hash"]), "rb") as f:
+                content = f.read()
+        except OSError:
+            with self.lock:
+                if url in self.entries:
+                    self._remove_entry(url)
+                self.stats["misses"] += 1
+            return None, False, None
+
+        fresh = time.time() - entry["fetched_at"] < self.freshness
+        with self.lock:
+            self.stats["hits" if fresh else "stale"] += 1
+        return content, fresh, entry
+
+    def revalidated(self, url):
+        """Mark a stale entry as fresh after the server answered 304 Not Modified"""
+        with self.lock:
+            if url in self.entries:
+                self.entries[url]["fetched_at"] = time.time()
+                self.stats["revalidated"] += 1
+                self._save()
+
+    def store(self, url, content, etag=None, last_modified=None):
+        content_hash = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(content_hash)
+        try:
+            if not os.path.isfile(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, blob_path)
+        except OSError as e:
+            print(f"comfy-deploy: Write image cache failed: {e}")
+            return
+
+        with self.lock:
+            self._load()
+            if url in self.entries:
+                self._remove_entry(url)
+            self._add_entry(url, {
+                "hash": content_hash,
+                "size": len(content),
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": time.time(),
+            })
+            self.stats["stores"] += 1
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self._remove_entry(next(iter(self.entries)))
+                self.stats["evictions"] += 1
+            self._save()
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "bytes": self.total_bytes,
+                    "max_bytes": self.max_bytes}
+
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_FRESHNESS)
+
+
+def fetch_image_bytes(url, client=None, retry_count=DOWNLOAD_RETRY_COUNT):
+    """
+    Get the bytes of an image url, taking a download prefetched at submission time if there is one
+
+    Parameters:
+        url: image url
+        client: optional httpx.Client, the shared pooled client is used by default
+        retry_count: number of attempts
+
+    Returns:
+        Image content, or None if every attempt failed
+    """
+    future = take_prefetched_image(url)
+    if future is not None:
+        content = future.result()
+        if content is not None:
+            print(f"comfy-deploy: Load prefetched image: {url}")
+            return content
+    return download_image_bytes(url, client, retry_count)
+
+
+def download_image_bytes(url, client=None, retry_count=DOWNLOAD_RETRY_COUNT):
+    """
+    Download an image url through the disk cache, retrying failed requests
+
+    Parameters:
+        url: image url
+        client: optional httpx.Client, the shared pooled client is used by default
+        retry_count: number of attempts
+
+    Returns:
+        Response content, the stale cached content if the host is unreachable,
+        or None if every attempt failed
+    """
+    cached, headers = None, {}
+    if IMAGE_CACHE_ENABLED:
+        cached, fresh, entry = image_cache.lookup(url)
+        if cached is not None:
+            if fresh:
+                print(f"comfy-deploy: Load image from cache: {url}")
+                return cached
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+    host = urlparse(url).netloc
+    if not host_health.allow(host):
+        if cached is not None:
+            print(f"comfy-deploy: Warning: Host {host} keeps failing, load stale image from cache: {url}")
+            return cached
+        raise CircuitOpenError(f"comfy-deploy: Host {host} keeps failing, skip download. Image URL: {url}")
+
+    client = client or get_http_client()
+    unreachable = False
+    for have_retry in range(1, retry_count + 1):
+        if have_retry > 1:
+            backoff = min(DOWNLOAD_RETRY_BACKOFF_MAX, DOWNLOAD_RETRY_BACKOFF * 2 ** (have_retry - 2))
+            time.sleep(backoff * random.uniform(0.5, 1.0))
+            if not host_health.allow(host):
+                if cached is not None:
+                    unreachable = True
+                    break
+                raise CircuitOpenError(f"comfy-deploy: Host {host} keeps failing, skip download. Image URL: {url}")
+        try:
+            start_time = time.time()
+            response = hedged_get(client, url, headers, host)
+            if response.status_code >= 500:
+                host_health.record_failure(host)
+                unreachable = True
+            else:
+                host_health.record_success(host, time.time() - start_time)
+            if response.status_code == 304 and cached is not None:
+                image_cache.revalidated(url)
+                print(f"comfy-deploy: Load image from cache (not modified): {url}")
+                return cached
+            if response.status_code == 200:
+                print(f"comfy-deploy: Success Load image from url: {url}")
+                if IMAGE_CACHE_ENABLED:
+                    image_cache.store(url, response.content, response.headers.get("etag"),
+                                      response.headers.get("last-modified"))
+                return response.content
+            else:
+                print(f"comfy-deploy: Failed to retrieve the image, status code: {response.status_code}")
+        except httpx.TransportError as e:
+            host_health.record_failure(host)
+            unreachable = True
+            print(f'Warning({have_retry}): comfy-deploy download image URL failed. Image URL: {url}. Error: {e!r}')
+        except Exception as e:
+            print(f'Warning({have_retry}): comfy-deploy download image URL failed. Image URL: {url}. Error: {e}')
+    if cached is not None and unreachable:
+        # A stale image is better than failing the task while the origin is unreachable
+        print(f"comfy-deploy: Warning: Download failed, load stale image from cache: {url}")
+        return cached
+    return None
+
+
+def hedged_get(client, url, headers, host):
+    """
+    GET a url, sending a second identical request if the first one has not finished after the p95 latency
+    of the host. The first successful response wins, the slower request finishes in the background
+    """
+    delay = host_health.hedge_delay(host) if HEDGE_ENABLED else None
+    if delay is None:
+        return client.get(url, headers=headers)
+
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _http_client_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="comfy-deploy-hedge")
+
+    pending = {_hedge_executor.submit(client.get, url, headers=headers)}
+    done, pending = wait(pending, timeout=delay)
+    if not done:
+        print(f"comfy-deploy: Request slower than {delay:.2f}s, send hedged request. Image URL: {url}")
+        pending.add(_hedge_executor.submit(client.get, url, headers=headers))
+
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+def is_upload_handle(value):
+    return isinstance(value, str) and value.startswith(UPLOAD_SCHEME)
+
+
+def resolve_upload_path(handle):
+    """
+    Resolve an upload://<id> handle to its spool file path
+
+    Returns:
+        File path, or None if the handle is malformed or the file does not exist
+    """
+    upload_id = handle[len(UPLOAD_SCHEME):]
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+        return None
+    path = os.path.join(UPLOAD_DIR, upload_id)
+    return path if os.path.isfile(path) else None
+
+
+def fetch_input_bytes(source):
+    """
+    Get the bytes of an image input, either an upload://<id> handle or an image url
+
+    Returns:
+        Image content, or None if it could not be loaded
+    """
+    if is_upload_handle(source):
+        path = resolve_upload_path(source)
+        if path is None:
+            print(f"comfy-deploy: Uploaded image not found: {source}")
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    return fetch_image_bytes(source)
+
+
+def prefetch_image(url):
+    """Start downloading an image url in the background, the node picks it up with fetch_image_bytes"""
+    if not PREFETCH_ENABLED:
+        return
+    global _prefetch_executor
+    now = time.time()
+    with _prefetch_lock:
+        # Drop prefetches no node has picked up, e.g. of tasks that were deleted from the queue
+        for expired_url in [key for key, (_, started_at) in _prefetched.items() if now - started_at > PREFETCH_TTL]:
+            del _prefetched[expired_url]
+        if url in _prefetched or len(_prefetched) >= PREFETCH_MAX_ENTRIES:
+            return
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS,
+                                                    thread_name_prefix="comfy-deploy-prefetch")
+        _prefetched[url] = (_prefetch_executor.submit(download_image_bytes, url), now)
+
+
+def take_prefetched_image(url):
+    with _prefetch_lock:
+        prefetched = _prefetched.pop(url, None)
+    return prefetched[0] if prefetched else None
+
+
+def parse_image_url_list(input_images):
+    """
+    Parse the url list input of the batch node: a JSON array, a bracketed or a comma separated list
+
+    Raises:
+        ValueError: if the input looks like a JSON array but is not valid JSON
+    """
+    if not isinstance(input_images, str):
+        return input_images
+    if "[" in input_images and "]" in input_images:
+        if '["' in input_images:
+            try:
+                return json.loads(input_images)
+            except json.JSONDecodeError as e:
+                raise ValueError(str(e))
+        input_images = input_images.split("[")[-1].split("]")[0]
+    return [x.strip() for x in input_images.split(",")]
+
+
+class TensorCache:
+    """Byte-budgeted LRU of decoded tensors, callers get a clone so cached tensors are never modified"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> tensor
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tensor = self.items.get(key)
+            if tensor is None:
+                self.stats["misses"] += 1
+                return None
+            self.items.move_to_end(key)
+            self.stats["hits"] += 1
+        return tensor.clone()
+
+    def put(self, key, tensor):
+        size = tensor.numel() * tensor.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                return
+            self.items[key] = tensor.clone()
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.total_bytes -= evicted.numel() * evicted.element_size()
+                self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.items), "bytes": self.total_bytes,
+                    "max_bytes": self.max_bytes}
+
+
+tensor_cache = TensorCache(TENSOR_CACHE_MAX_BYTES)
+
+
+def pil_to_tensor(image, out=None):
+    """
+    Convert a PIL image to a float32 [H,W,C] tensor in [0, 1]
+
+    The uint8 pixels are read from the PIL buffer once and normalized straight into the float32
+    output, instead of allocating a float copy and a second array for the division
+
+    Parameters:
+        image: PIL image
+        out: optional preallocated float32 [H,W,C] CPU tensor to write into, may be a view of a batch
+    """
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = array[..., None]
+    if out is None:
+        out = torch.from_numpy(np.empty(array.shape, dtype=np.float32))
+    np.divide(array, np.float32(255.0), out=out.numpy())
+    return out
+
+
+def prepare_image(image, keep_alpha_channel):
+    """Apply the EXIF orientation and convert to RGBA or RGB"""
+    image = ImageOps.exif_transpose(image)
+    if keep_alpha_channel:
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def image_to_tensor(image, keep_alpha_channel):
+    """Convert a PIL image to a [1,H,W,C] float32 IMAGE tensor"""
+    return pil_to_tensor(prepare_image(image, keep_alpha_channel))[None, ]
+
+
+def stack_images(images, policy="resize"):
+    """
+    Write prepared PIL images of possibly different sizes into one preallocated [N,H,W,C] IMAGE tensor
+
+    Parameters:
+        images: list of PIL images with the same mode
+        policy: "resize" stretches to the size of the first image, "crop" scales and center crops to it,
+            "pad" centers every image on a canvas of the largest width and height
+
+    Returns:
+        Tuple (image [N,H,W,C], mask [N,H,W]), mask is 1.0 on padding
+    """
+    channels = len(images[0].getbands())
+    if policy == "pad":
+        width = max(image.width for image in images)
+        height = max(image.height for image in images)
+    else:
+        width, height = images[0].size
+
+    batch = torch.zeros((len(images), height, width, channels), dtype=torch.float32)
+    mask = torch.zeros((len(images), height, width), dtype=torch.float32)
+    for index, image in enumerate(images):
+        if image.size == (width, height):
+            pil_to_tensor(image, out=batch[index])
+        elif policy == "pad":
+            left = (width - image.width) // 2
+            top = (height - image.height) // 2
+            mask[index] = 1.0
+            mask[index, top:top + image.height, left:left + image.width] = 0.0
+            pil_to_tensor(image, out=batch[index, top:top + image.height, left:left + image.width])
+        elif policy == "crop":
+            pil_to_tensor(ImageOps.fit(image, (width, height), Image.LANCZOS), out=batch[index])
+        else:
+            pil_to_tensor(image.resize((width, height), Image.LANCZOS), out=batch[index])
+    return batch, mask
+
+
+def open_image(content, max_side=0):
+    """
+    Open encoded image bytes, downscaling oversized images while decoding
+
+    JPEG is decoded at a reduced DCT scale with draft(), other formats are shrunk by an integer factor
+    with reduce() before the final resample, so full resolution pixels are never converted
+
+    Parameters:
+        content: encoded image bytes
+        max_side: maximum width/height of the result, 0 keeps the original size
+    """
+    image = Image.open(BytesIO(content))
+    if max_side <= 0 or max(image.size) <= max_side:
+        return image
+
+    scale = max_side / max(image.size)
+    target_size = (max(1, math.ceil(image.width * scale)), max(1, math.ceil(image.height * scale)))
+    if image.format == "JPEG":
+        # Picks the smallest DCT scale that is still at least target_size
+        image.draft(None, target_size)
+
+    factor = min(image.width // target_size[0], image.height // target_size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    if max(image.size) > max_side:
+        image = image.resize(target_size, Image.LANCZOS)
+    return image
+
+
+def load_image_tensor(content, keep_alpha_channel, max_side=0):
+    """
+    Decode encoded image bytes to an IMAGE tensor, identical inputs are served from the tensor cache
+
+    Parameters:
+        content: encoded image bytes
+        keep_alpha_channel: keep the alpha channel (RGBA) instead of converting to RGB
+        max_side: maximum width/height of the result, 0 keeps the original size
+    """
+    if not TENSOR_CACHE_ENABLED:
+        return image_to_tensor(open_image(content, max_side), keep_alpha_channel)
+
+    key = (hashlib.blake2b(content, digest_size=16).hexdigest(), bool(keep_alpha_channel), max_side)
+    tensor = tensor_cache.get(key)
+    if tensor is not None:
+        return tensor
+
+    tensor = image_to_tensor(open_image(content, max_side), keep_alpha_channel)
+    tensor_cache.put(key, tensor)
+    return tensor
+
+
+def make_thumbnail(source, max_side=256, quality=75):
+    """
+    Create a downscaled WebP thumbnail, runs in a worker thread
+
+    Parameters:
+        source: image file path or encoded image bytes
+        max_side: maximum width/height of the thumbnail
+        quality: WebP quality
+
+    Returns:
+        Tuple (webp bytes, width, height)
+    """
+    with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+        # JPEG can decode at a reduced scale directly
+        image.draft("RGB", (max_side, max_side))
+        image.thumbnail((max_side, max_side))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        buffer = BytesIO()
+        image.save(buffer, format="WEBP", quality=quality, method=0)
+        return buffer.getvalue(), image.width, image.height